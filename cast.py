@@ -495,12 +495,11 @@ FileAST:
             IdentifierType: ['int']
 """
 
-from pycparser import CParser
 from io import StringIO
+from cmin import same_ast
 
 def parse(s):
-    parser = CParser()
-    ast = parser.parse(s)
+    ast = same_ast(s)
     buf = StringIO()
     ast.show(buf)
     print(buf.getvalue(), end='')
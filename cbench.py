@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""Compiles the translation of a solution and its minified version with the
+same flags, runs both on every case of the solution many times and compares
+their CPU time and peak memory.
+
+>>> print(compare([1.0, 1.1, 0.9, 1.0], [1.2, 1.3, 1.1, 1.2]))
++20.0% [+8.7%, +31.3%]
+>>> print(compare([1.0, 1.1, 0.9, 1.0], [1.0, 1.1, 0.9, 1.0]))
++0.0% [-11.3%, +11.3%]
+>>> compare([0.0, 0.0], [0.0, 0.0]).relative
+0.0
+"""
+
+import os
+import sys
+from math import sqrt
+from statistics import NormalDist, fmean, variance
+from subprocess import run
+from tempfile import TemporaryDirectory, TemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from cmin import PASSES, define_inttypes, minify, compile_c
+
+
+class Sample(NamedTuple):
+    seconds: float
+    rss: int
+
+
+class Delta(NamedTuple):
+    before: float
+    after: float
+    low: float
+    high: float
+
+    def percent(self, value):
+        return 100 * value / self.before if self.before else 0.0
+
+    @property
+    def relative(self):
+        return self.percent(self.after - self.before)
+
+    def __str__(self):
+        return f"{self.relative:+.1f}% [{self.percent(self.low):+.1f}%, {self.percent(self.high):+.1f}%]"
+
+
+def compare(before, after, confidence=0.95):
+    """Difference of the means of after and before, with an interval from
+    the normal approximation of their unequal variances."""
+    spread = sqrt(variance(before) / len(before) + variance(after) / len(after)) if min(len(before), len(after)) > 1 else 0.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    mean_before, mean_after = fmean(before), fmean(after)
+    difference = mean_after - mean_before
+    return Delta(mean_before, mean_after, difference - z * spread, difference + z * spread)
+
+
+RUNNER = r"""#define _DEFAULT_SOURCE
+#include <stdio.h>
+#include <unistd.h>
+#include <sys/wait.h>
+#include <sys/resource.h>
+
+int main(int argc, char **argv)
+{
+  int status;
+  struct rusage usage;
+  FILE *report;
+  pid_t pid = fork();
+  if (pid == 0)
+  {
+    execv(argv[2], argv + 2);
+    _exit(127);
+  }
+  if (pid < 0 || wait4(pid, &status, 0, &usage) < 0 || !(report = fopen(argv[1], "w")))
+    return 126;
+  fprintf(report, "%ld.%06ld %ld.%06ld %ld\n", (long) usage.ru_utime.tv_sec, (long) usage.ru_utime.tv_usec,
+          (long) usage.ru_stime.tv_sec, (long) usage.ru_stime.tv_usec, usage.ru_maxrss);
+  fclose(report);
+  return WIFEXITED(status) ? WEXITSTATUS(status) : 128 + WTERMSIG(status);
+}
+"""
+
+
+def measure(runner, exe, case):
+    """Runs exe under runner, which forks it from a process of its own so
+    that the peak memory is not that of this interpreter."""
+    report = f"{runner}.report"
+    with open(os.path.join(case, "in"), "rb") as stdin, TemporaryFile() as stdout:
+        returncode = run([runner, report, exe], stdin=stdin, stdout=stdout).returncode
+        stdout.seek(0)
+        output = stdout.read()
+    with open(os.path.join(case, "out"), "rb") as f:
+        expected = f.read()
+    assert returncode == 0, f"{exe}: exit status {returncode} on {case}"
+    assert output == expected, f"{exe}: wrong answer on {case}"
+    with open(report) as f:
+        utime, stime, rss = f.read().split()
+    return Sample(float(utime) + float(stime), int(rss))
+
+
+def benchmark(input, path, bits, tests, runs=20, flags=("-O2",), confidence=0.95, threshold=5.0, file=None, **options):
+    cases_dir = os.path.join(tests, os.path.splitext(path)[0])
+    cases = sorted(e.name for e in os.scandir(cases_dir) if e.is_dir())
+    assert cases, f"no cases in {cases_dir}"
+
+    with open(input, 'r') as f:
+        code = f.read()
+    programs = [("original", ''.join(define_inttypes(bits)) + code, os.path.dirname(os.path.abspath(__file__))),
+                ("minified", minify(code, bits, input, **options).code)]
+
+    with TemporaryDirectory() as tmp:
+        with ThreadPoolExecutor() as pool:
+            exes = list(pool.map(lambda p: compile_c(p[1], tmp, p[0], p[2:], flags), programs))
+            runner = compile_c(RUNNER, tmp, "runner")
+        samples = {case: ([], []) for case in cases}
+        for run in range(runs):
+            for case in cases:
+                order = (0, 1) if run % 2 == 0 else (1, 0)
+                for i in order:
+                    samples[case][i].append(measure(runner, exes[i], os.path.join(cases_dir, case)))
+
+    totals = ([Sample(*map(sum, zip(*(samples[case][i][run] for case in cases)))) for run in range(runs)]
+              for i in (0, 1))
+    rows = [(case, *samples[case]) for case in cases] + [("total", *totals)]
+
+    width = max(len(row[0]) for row in rows + [("case",)])
+    print(path, file=file)
+    print(f"{'case':<{width}}  {'cpu':<42}  rss", file=file)
+    for name, before, after in rows:
+        cpu = compare([s.seconds for s in before], [s.seconds for s in after], confidence)
+        rss = compare([s.rss for s in before], [s.rss for s in after], confidence)
+        print(f"{name:<{width}}  {f'{cpu.before*1000:.2f}ms -> {cpu.after*1000:.2f}ms {cpu}':<42}  "
+              f"{rss.before:.0f}kB -> {rss.after:.0f}kB {rss}", file=file)
+
+    regressions = [kind for kind, delta in (("cpu", cpu), ("rss", rss))
+                   if delta.low > 0 and delta.relative > threshold]
+    for kind in regressions:
+        print(f"{path}: minified {kind} regressed by more than {threshold}%", file=file)
+    return bool(regressions)
+
+
+def main(bits, tests, input, path, solutions=(), runs=20, cflags="-O2", confidence=0.95, threshold=5.0,
+         level=2, enable=(), disable=()):
+    bits = tuple(map(int, bits.split(",")))
+    return sum(benchmark(input, path, bits, tests, runs, cflags.split(), confidence, threshold, sys.stdout,
+                         level=level, enable=enable, disable=disable)
+               for input, path in [(input, path), *solutions])
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    argparser = ArgumentParser()
+    argparser.add_argument('bits')
+    argparser.add_argument('tests')
+    argparser.add_argument('input')
+    argparser.add_argument('path',
+                           help='path of the solution, whose cases are TESTS/<path>/<case>/{in,out}')
+    argparser.add_argument('--solution', dest='solutions', nargs=2, action='append', default=[], metavar=('INPUT', 'PATH'),
+                           help='also benchmark the translation INPUT of the solution at PATH')
+    argparser.add_argument('--runs', type=int, default=20, metavar='N',
+                           help='run each program N times on each case')
+    argparser.add_argument('--cflags', default="-O2", metavar='FLAGS',
+                           help='compile both programs with FLAGS')
+    argparser.add_argument('--confidence', type=float, default=0.95,
+                           help='confidence level of the intervals')
+    argparser.add_argument('--threshold', type=float, default=5.0, metavar='PERCENT',
+                           help='flag a solution whose total cpu or rss grows by more than PERCENT')
+    argparser.add_argument('-O', dest='level', type=int, choices=range(4), default=2,
+                           help='minify at this level, as cmin -O does')
+    argparser.add_argument('--enable', action='append', default=[], choices=[p.name for p in PASSES], metavar='PASS',
+                           help='run PASS even if the level does not include it')
+    argparser.add_argument('--disable', action='append', default=[], choices=[p.name for p in PASSES], metavar='PASS',
+                           help='do not run PASS')
+    sys.exit(1 if main(**vars(argparser.parse_args())) else 0)
@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import sys
+import time
+import json
+import subprocess
 from io import StringIO
+from bisect import bisect_left, bisect_right
+from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Mapping, NamedTuple, Any
+from types import MappingProxyType
 from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from itertools import repeat
+from hashlib import sha256
+from heapq import heapify, heappush, heappop
 from pcpp import Preprocessor
 from pycparser import CParser, c_generator
-from pycparser.c_ast import Node, Decl, TypeDecl, Struct, Union, Enum, IdentifierType, InitList, NamedInitializer, ArrayDecl, PtrDecl, FuncDecl, FuncDef, Compound, Switch, If, ID
+from pycparser.c_ast import Node, FileAST, Decl, TypeDecl, Struct, Union, Enum, IdentifierType, InitList, NamedInitializer, ArrayDecl, PtrDecl, FuncDecl, FuncDef, Compound, Switch, If, ID
+from pycparser.c_ast import Typedef, Typename, Alignas, Enumerator, EnumeratorList, ParamList, EllipsisParam, Pragma, StaticAssert, DeclList, Label, Case, Default, While, DoWhile, For, Goto, Break, Continue, Return, EmptyStatement, ExprList, Assignment, TernaryOp, BinaryOp, UnaryOp, Cast, CompoundLiteral, ArrayRef, FuncCall, StructRef, Constant
+from pycparser.ast_transforms import fix_switch_cases, fix_atomic_specifiers
+from pycparser.plyparser import Coord, ParseError
 
 
 class BaseVisitor:
@@ -19,32 +36,78 @@ class BaseVisitor:
         assert False, f'Not implemeneted {node.__class__.__name__}'
 
 
+EMPTY = MappingProxyType({})
+NAMES = ContextVar('NAMES', default=EMPTY)
+
+
+@contextmanager
+def naming(names):
+    token = NAMES.set(names)
+    try:
+        yield
+    finally:
+        NAMES.reset(token)
+
+
 class Symbol:
+    """A renamed identifier. It is written as the name the current naming
+    maps it to, or else as its own name."""
 
     def __init__(self, orig_name):
         self.orig_name = orig_name
 
     def __add__(self, other):
-        return self.name + other
+        return str(self) + other
 
     def __radd__(self, other):
-        return other + self.name
+        return other + str(self)
 
     def __str__(self):
-        return self.name
+        return NAMES.get().get(self, self.name)
 
 class CGenerator(c_generator.CGenerator):
+    """Given names, writes symbols by them instead of the naming in effect."""
+
+    def __init__(self, reduce_parentheses=False, names=None):
+        super().__init__(reduce_parentheses)
+        self.names = names
+
+    def visit(self, node):
+        if self.names is None or NAMES.get() is self.names:
+            return super().visit(node)
+        with naming(self.names):
+            return super().visit(node)
 
     def visit_IdentifierType(self, n):
         return ' '.join(str(name) for name in n.names)
 
     def visit_DeclList(self, n):
         s = self.visit(n.decls[0])
-        if len(n.decls) > 1:
-            s += ', ' + ', '.join(str(self.visit_Decl(decl, no_type=True))
-                                  for decl in n.decls[1:])
+        for decl in n.decls[1:]:
+            t = base_type(decl.type)
+            spec = self._generate_decl(Decl(None, [], decl.align, decl.storage, decl.funcspec,
+                                            TypeDecl(None, t.quals, t.align, t.type), None, None))
+            s += ', ' + self.visit_Decl(decl)[len(spec):].lstrip()
         return s
 
+    def _generate_stmt(self, n, add_indent=False):
+        if not isinstance(n, DeclList):
+            return super()._generate_stmt(n, add_indent)
+        self.indent_level += 2 * add_indent
+        indent = self._make_indent()
+        self.indent_level -= 2 * add_indent
+        return indent + self.visit(n) + ';\n'
+
+    def visit_Assignment(self, n):
+        lvalue = self._parenthesize_if(n.lvalue, lambda d: isinstance(d, (TernaryOp, BinaryOp, Cast, Assignment, ExprList)))
+        rvalue = self._parenthesize_if(n.rvalue, lambda d: isinstance(d, Assignment))
+        return f'{lvalue} {n.op} {rvalue}'
+
+    def visit_TernaryOp(self, n):
+        cond = self._parenthesize_if(n.cond, lambda d: isinstance(d, (TernaryOp, Assignment, ExprList)))
+        iffalse = self._parenthesize_if(n.iffalse, lambda d: isinstance(d, (Assignment, ExprList)))
+        return f'{cond} ? {self._visit_expr(n.iftrue)} : {iffalse}'
+
     def visit_ExprList(self, n):
         visited_subexprs = []
         for expr in n.exprs:
@@ -152,44 +215,2316 @@ def rewrite_struct_declaration(s):
     >>> rewrite_struct_declaration('void f() { struct X {int a;} a,b; }')
     void f()
     {
-      struct X
-      {
-        int a;
-      } a;
-      struct X b;
+      struct X
+      {
+        int a;
+      } a;
+      struct X b;
+    }
+    <BLANKLINE>
+    >>> rewrite_struct_declaration('void f() { for (;;){ struct X {int a;} a,b; } }')
+    void f()
+    {
+      for (;;)
+      {
+        struct X
+        {
+          int a;
+        } a;
+        struct X b;
+      }
+    <BLANKLINE>
+    }
+    <BLANKLINE>
+    >>> rewrite_struct_declaration('void f() { for (struct X {int a;} a,b;;); }')
+    void f()
+    {
+      for (struct X
+      {
+        int a;
+      } a, b;;)
+        ;
+    <BLANKLINE>
+    }
+    <BLANKLINE>
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    generator = CGenerator()
+    print(generator.visit(ast), end='')
+
+C_ESCAPES = {'n': 10, 't': 9, 'r': 13, 'a': 7, 'b': 8, 'f': 12, 'v': 11, 'e': 27, '\\': 92, "'": 39, '"': 34, '?': 63}
+C_ESCAPE = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]+)|(.))|(.)', re.S)
+C_DIM = re.compile(r'([1-9]\d*)[uUlL]*')
+
+
+def string_bytes(value):
+    if not value.startswith('"'):
+        return None
+    out = bytearray()
+    for m in C_ESCAPE.finditer(value[1:-1]):
+        octal, hexa, escape, char = m.groups()
+        if octal is not None:
+            out.append(int(octal, 8) & 255)
+        elif hexa is not None:
+            out.append(int(hexa, 16) & 255)
+        elif escape is not None:
+            if escape not in C_ESCAPES:
+                return None
+            out.append(C_ESCAPES[escape])
+        else:
+            out.extend(char.encode())
+    out.append(0)
+    return bytes(out)
+
+
+def walk(node, parent=None):
+    yield node, parent
+    for _, child in node.children():
+        yield from walk(child, node)
+
+
+def replace_child(parent, old, new):
+    for attr in parent.__slots__:
+        value = getattr(parent, attr, None)
+        if value is old:
+            setattr(parent, attr, new)
+            return
+        if isinstance(value, list) and any(v is old for v in value):
+            value[[id(v) for v in value].index(id(old))] = new
+            return
+    assert False, f'{old.__class__.__name__} is not a child of {parent.__class__.__name__}'
+
+
+def clone(node, memo=None):
+    if memo is None:
+        memo = {}
+    if isinstance(node, list):
+        return [clone(n, memo) for n in node]
+    if not isinstance(node, Node):
+        return node
+    if id(node) in memo:
+        return memo[id(node)]
+    copy = memo[id(node)] = object.__new__(node.__class__)
+    for attr in node.__slots__[:-1]:
+        setattr(copy, attr, clone(getattr(node, attr), memo))
+    return copy
+
+
+class StringArray(NamedTuple):
+    name: str
+    index: int
+    key: Any
+    data: bytes
+    decls: list
+
+
+class StringPool(BaseVisitor):
+    """Hoists repeated string literals into arrays, folds identical string
+    arrays into one and points arrays that are suffixes of others into them.
+    Sizes are estimated assuming one character names after renaming.
+    Folded arrays share storage, so arrays whose addresses are compared or
+    subtracted where they are named are left alone; pointers to them that
+    are stored or passed on are assumed not to be compared, as C already
+    allows for string literals."""
+
+    def __init__(self):
+        super().__init__()
+        self.saved = {}
+
+    def count(self, kind, saved):
+        n, total = self.saved.get(kind, (0, 0))
+        self.saved[kind] = (n + 1, total + saved)
+
+    def visit_FileAST(self, node):
+        self.hoist(node)
+        nodes = list(walk(node))
+        local = {n.name for n, p in nodes
+                 if isinstance(n, (Decl, Typedef, Enumerator)) and p is not node}
+        refs = {}
+        for n, p in nodes:
+            if not isinstance(n, ID):
+                continue
+            if isinstance(p, StructRef) and p.field is n:
+                continue
+            if isinstance(p, NamedInitializer) and p.expr is not n:
+                continue
+            refs.setdefault(n.name, []).append((n, p))
+        parents = {id(n): p for n, p in nodes}
+
+        decls = {}
+        for i, d in enumerate(node.ext):
+            if isinstance(d, Decl) and d.name is not None:
+                decls.setdefault(d.name, []).append(i)
+
+        arrays = []
+        for name, indices in decls.items():
+            a = self.string_array(node, name, indices)
+            if a is not None and name not in local and not self.compared(refs.get(name, ()), parents):
+                arrays.append(a)
+        arrays.sort(key=lambda a: a.index)
+
+        removed = set()
+        kept = {}
+        for a in arrays:
+            b = kept.setdefault((a.key, a.data), a)
+            if b is a:
+                continue
+            for n, _ in refs.get(a.name, ()):
+                n.name = b.name
+            refs.setdefault(b.name, []).extend(refs.pop(a.name, ()))
+            self.count('merged', sum(self.decl_size(node.ext[i]) for i in a.decls))
+            removed.update(a.decls)
+
+        arrays = sorted(kept.values(), key=lambda a: len(a.data), reverse=True)
+        for i, b in enumerate(arrays):
+            for a in arrays[:i]:
+                if a.key != b.key or a.index > b.index or not a.data.endswith(b.data) or a.decls[0] in removed:
+                    continue
+                offset = len(a.data) - len(b.data)
+                uses = self.decayed_uses(refs.get(b.name, ()), parents)
+                if uses is None:
+                    continue
+                saved = sum(self.decl_size(node.ext[j]) for j in b.decls)
+                saved -= sum(len(f' + {offset}') - (use is not n) for n, use in uses)
+                if saved <= 0:
+                    continue
+                for n, use in uses:
+                    replace_child(parents[id(use)], use, BinaryOp('+', ID(a.name), Constant('int', str(offset))))
+                self.count('suffix-merged', saved)
+                removed.update(b.decls)
+                break
+
+        node.ext = [d for i, d in enumerate(node.ext) if i not in removed]
+
+    def string_array(self, node, name, indices):
+        defs = [i for i in indices if node.ext[i].init is not None]
+        if len(defs) != 1:
+            return None
+        d = node.ext[defs[0]]
+        if not isinstance(d.init, Constant) or d.init.type != 'string' or 'extern' in d.storage:
+            return None
+        if not isinstance(d.type, ArrayDecl) or not isinstance(d.type.type, TypeDecl):
+            return None
+        if not isinstance(d.type.type.type, IdentifierType) or 'const' not in d.type.type.quals:
+            return None
+        data = string_bytes(d.init.value)
+        if data is None:
+            return None
+        if d.type.dim is not None:
+            m = C_DIM.fullmatch(getattr(d.type.dim, 'value', ''))
+            if m is None or int(m.group(1)) != len(data):
+                return None
+        key = (tuple(d.quals), tuple(d.type.type.quals), tuple(d.type.type.type.names))
+        return StringArray(name, indices[0], key, data, indices)
+
+    def decayed_uses(self, refs, parents):
+        uses = []
+        for n, p in refs:
+            if isinstance(p, UnaryOp) and p.op == '&':
+                if not (isinstance(parents[id(p)], Cast) and isinstance(parents[id(p)].to_type.type, PtrDecl)):
+                    return None
+                uses.append((n, p))
+            elif isinstance(p, UnaryOp) and p.op in ('sizeof', '_Alignof'):
+                return None
+            elif isinstance(p, (Decl, InitList)):
+                return None
+            else:
+                uses.append((n, n))
+        return uses
+
+    def compared(self, refs, parents):
+        for n, p in refs:
+            while isinstance(p, (Cast, TernaryOp)) or isinstance(p, UnaryOp) and p.op == '&' or isinstance(p, BinaryOp) and (
+                    p.op == '+' or p.op == '-' and p.left is n):
+                if isinstance(p, TernaryOp) and p.cond is n:
+                    break
+                n, p = p, parents[id(p)]
+            if isinstance(p, BinaryOp) and p.op in ('==', '!=', '<', '>', '<=', '>=', '-'):
+                return True
+        return False
+
+    def decl_size(self, d):
+        return len(CGenerator().visit(d)) + 3 - len(d.name) - sum(len(s) + 1 for s in d.storage)
+
+    def hoist(self, node):
+        literals = {}
+        names = set()
+        for n, p in walk(node):
+            if isinstance(n, ID):
+                names.add(n.name)
+            elif isinstance(n, (Decl, Typedef)):
+                names.add(n.name)
+            elif isinstance(n, Constant) and n.type == 'string' and n.value.startswith('"'):
+                if isinstance(p, (InitList, NamedInitializer, StaticAssert)):
+                    continue
+                if isinstance(p, Decl) and not isinstance(p.type, PtrDecl):
+                    continue
+                if isinstance(p, UnaryOp) and p.op in ('sizeof', '_Alignof'):
+                    continue
+                literals.setdefault(n.value, []).append((n, p))
+
+        for value, uses in literals.items():
+            i = 0
+            while f'str{i}' in names:
+                i += 1
+            name = f'str{i}'
+            decl = Decl(name, [], [], ['static'], [], ArrayDecl(TypeDecl(name, [], None, IdentifierType(['char'])), None, []),
+                        Constant('string', value), None)
+            saved = len(value) * len(uses) - len(uses) - self.decl_size(decl)
+            if saved <= 0:
+                continue
+            names.add(name)
+            for n, p in uses:
+                replace_child(p, n, ID(name))
+            first = min(next(j for j, d in enumerate(node.ext) for m, _ in walk(d) if m is p) for _, p in uses)
+            node.ext.insert(first, decl)
+            self.count('hoisted', saved)
+
+
+def pool_strings(s):
+    """
+    >>> pool_strings('extern int printf(const char *, ...); int main() { printf("hello, world"); printf("hello, world"); printf("hello, world"); }')
+    #include <stdio.h>
+    char A[] = "hello, world";
+    int main()
+    {
+      printf(A);
+      printf(A);
+      printf(A);
+    }
+    <BLANKLINE>
+        12  saved on 1 hoisted string literals
+    >>> pool_strings('extern int printf(const char *, ...); int main() { printf("hi"); printf("hi"); printf("hi"); }')
+    #include <stdio.h>
+    int main()
+    {
+      printf("hi");
+      printf("hi");
+      printf("hi");
+    }
+    <BLANKLINE>
+    >>> pool_strings('extern int printf(const unsigned char *, ...); static const unsigned char s[8] = "a %s b\\\\n"; static const unsigned char t[8] = "a %s b\\\\n"; static const unsigned char u[4] = " b\\\\n";'
+    ...              'int main() { printf((const unsigned char *)&s, (const unsigned char *)&t); printf((const unsigned char *)&u); }')
+    #include <stdio.h>
+    const unsigned char A[8] = "a %s b\\n";
+    int main()
+    {
+      printf((const unsigned char *) (&A), (const unsigned char *) (&A));
+      printf((const unsigned char *) (A + 4));
+    }
+    <BLANKLINE>
+        39  saved on 1 merged string literals
+        32  saved on 1 suffix-merged string literals
+    >>> pool_strings('static const char s[3] = "ab", t[2] = "b"; int main() { return sizeof t + s[0]; }')
+    const char A[3] = "ab";
+    const char B[2] = "b";
+    int main()
+    {
+      return (sizeof(B)) + A[0];
+    }
+    <BLANKLINE>
+    >>> pool_strings('static char s[3] = "ab"; static char t[3] = "ab"; int main(void) { s[0] = 120; return t[0]; }')
+    char A[3] = "ab";
+    char B[3] = "ab";
+    int main(void)
+    {
+      A[0] = 120;
+      return B[0];
+    }
+    <BLANKLINE>
+    >>> pool_strings('static const char s[3] = "ab", t[2] = "b", u[3] = "ab"; int main(void) { return s + 1 == t || (const char *)&u != s; }')
+    const char A[3] = "ab";
+    const char B[2] = "b";
+    const char C[3] = "ab";
+    int main(void)
+    {
+      return A + 1 == B || ((const char *) (&C)) != A;
+    }
+    <BLANKLINE>
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    pool = StringPool()
+    pool.visit(ast)
+    headers = SymbolRenamer().visit(ast)
+    generator = CGenerator(reduce_parentheses=True)
+    print("".join(f"#include <{h}>\n" for h in headers) + generator.visit(ast), end='')
+    for kind, (n, saved) in pool.saved.items():
+        print(f"{saved:>6}  saved on {n} {kind} string literals")
+
+
+class Var(NamedTuple):
+    name: str
+
+
+class Rule(NamedTuple):
+    name: str
+    pattern: Any
+    replacement: Any
+    where: Any = None
+
+
+def match(pattern, node, env):
+    if isinstance(pattern, Var):
+        if pattern.name == '_':
+            return True
+        if pattern.name in env:
+            return match(env[pattern.name], node, {})
+        env[pattern.name] = node
+        return True
+    if isinstance(pattern, list) or isinstance(node, list):
+        pattern, node = pattern or [], node or []
+        return (isinstance(pattern, list) and isinstance(node, list) and len(pattern) == len(node)
+                and all(match(p, n, env) for p, n in zip(pattern, node)))
+    if not isinstance(pattern, Node):
+        return pattern == node
+    return type(pattern) is type(node) and all(
+        match(getattr(pattern, attr), getattr(node, attr), env)
+        for attr in pattern.__slots__[:-1] if attr != 'coord')
+
+
+def instantiate(template, env):
+    if callable(template):
+        return template(env)
+    if isinstance(template, Var):
+        return env[template.name]
+    if isinstance(template, list):
+        return [instantiate(t, env) for t in template]
+    if not isinstance(template, Node):
+        return template
+    node = object.__new__(template.__class__)
+    for attr in template.__slots__[:-1]:
+        setattr(node, attr, instantiate(getattr(template, attr), env))
+    return node
+
+
+def base_type(t):
+    while not isinstance(t, TypeDecl):
+        t = t.type
+    return t
+
+
+def is_pure(e):
+    if isinstance(e, (ID, Constant)):
+        return True
+    if isinstance(e, StructRef):
+        return is_pure(e.name)
+    if isinstance(e, ArrayRef):
+        return is_pure(e.name) and is_pure(e.subscript)
+    if isinstance(e, UnaryOp):
+        return e.op in ('*', '&', '-', '+', '~', '!', 'sizeof') and is_pure(e.expr)
+    if isinstance(e, Cast):
+        return is_pure(e.expr)
+    if isinstance(e, BinaryOp):
+        return is_pure(e.left) and is_pure(e.right)
+    return False
+
+
+def is_lvalue(e):
+    if isinstance(e, UnaryOp) and e.op != '*':
+        return False
+    return isinstance(e, (ID, StructRef, ArrayRef, UnaryOp)) and is_pure(e)
+
+
+def is_int_literal(e):
+    return isinstance(e, Constant) and 'int' in e.type and 'char' not in e.type
+
+
+def open_if(s):
+    if isinstance(s, If):
+        return s.iffalse is None or open_if(s.iffalse)
+    if isinstance(s, (While, For, Switch, Label)):
+        return open_if(s.stmt)
+    return False
+
+
+def declarators(d):
+    return d.decls if isinstance(d, DeclList) else [d]
+
+
+def same_specifiers(a, b):
+    if not isinstance(a, Decl) or not isinstance(b, Decl) or a.name is None or b.name is None or a.align or b.align:
+        return False
+    if (a.storage, a.funcspec) != (b.storage, b.funcspec):
+        return False
+    ta, tb = base_type(a.type), base_type(b.type)
+    if ta.quals != tb.quals:
+        return False
+    if isinstance(ta.type, IdentifierType):
+        return match(ta.type, tb.type, {})
+    if isinstance(tb.type, Enum):
+        return type(ta.type) is Enum and tb.type.values is None and ta.type.name is not None and ta.type.name == tb.type.name
+    return (type(ta.type) is type(tb.type) and tb.type.decls is None
+            and ta.type.name is not None and ta.type.name == tb.type.name)
+
+
+def can_merge(p, e, parent):
+    return all(same_specifiers(declarators(e['a'])[0], d) for d in declarators(e['b']))
+
+
+def can_drop_braces(p, e, parent):
+    s = e['s']
+    if isinstance(parent, (FuncDef, Switch)) or isinstance(s, (Decl, DeclList, Typedef, StaticAssert, Case, Default)):
+        return False
+    if isinstance(parent, If) and parent.iffalse is not None and open_if(s):
+        return not (isinstance(parent.iftrue, Compound) and s in (parent.iftrue.block_items or ()))
+    return True
+
+
+def can_flatten(p, e, parent):
+    return isinstance(e['s'], Compound) and not any(
+        isinstance(s, (Decl, DeclList, Typedef, StaticAssert)) for s in e['s'].block_items or ())
+
+
+C_COMPOUND_ASSIGN = {'+', '-', '*', '/', '%', '<<', '>>', '&', '|', '^'}
+C_COMMUTATIVE = {'+', '*', '&', '|', '^'}
+
+
+def peephole_rules():
+    x, y, a, b, c, s, op, _ = (Var(name) for name in ('x', 'y', 'a', 'b', 'c', 's', 'op', '_'))
+    one = Constant('int', '1')
+    return [
+        Rule('while (1)', While(one, s), For(None, None, None, s)),
+        Rule('do while (1)', DoWhile(one, s), For(None, None, None, s)),
+        Rule('x = x + 1', Assignment('=', x, BinaryOp('+', x, one)), UnaryOp('++', x),
+             lambda p, e, parent: is_lvalue(e['x'])),
+        Rule('x = x - 1', Assignment('=', x, BinaryOp('-', x, one)), UnaryOp('--', x),
+             lambda p, e, parent: is_lvalue(e['x'])),
+        Rule('x += 1', Assignment('+=', x, one), UnaryOp('++', x)),
+        Rule('x -= 1', Assignment('-=', x, one), UnaryOp('--', x)),
+        Rule('x = x op y', Assignment('=', x, BinaryOp(op, x, y)),
+             lambda e: Assignment(e['op'] + '=', e['x'], e['y']),
+             lambda p, e, parent: e['op'] in C_COMPOUND_ASSIGN and is_lvalue(e['x'])),
+        Rule('x = y op x', Assignment('=', x, BinaryOp(op, y, x)),
+             lambda e: Assignment(e['op'] + '=', e['x'], e['y']),
+             lambda p, e, parent: e['op'] in C_COMMUTATIVE and is_lvalue(e['x']) and is_pure(e['y'])),
+        Rule('if else assignment', If(c, Assignment('=', x, a), Assignment('=', x, b)),
+             Assignment('=', x, TernaryOp(c, a, b)),
+             lambda p, e, parent: is_lvalue(e['x']) and p.compatible(e['a'], e['b'])),
+        Rule('if else return', If(c, Return(a), Return(b)), Return(TernaryOp(c, a, b)),
+             lambda p, e, parent: e['a'] is not None and e['b'] is not None and p.compatible(e['a'], e['b'])),
+        Rule('braces', Compound([s]), s, can_drop_braces),
+        Rule('empty braces', Compound([]), EmptyStatement(),
+             lambda p, e, parent: not isinstance(parent, (FuncDef, Compound))),
+        Rule('nested block', [s], lambda e: e['s'].block_items or [], can_flatten),
+        Rule('empty statement', [EmptyStatement()], [], lambda p, e, parent: isinstance(parent, Compound)),
+        Rule('declarations', [a, b], lambda e: [DeclList(declarators(e['a']) + declarators(e['b']))], can_merge),
+    ]
+
+
+class Peephole(BaseVisitor):
+    """Applies rules to the renamed tree until none matches. Rule patterns
+    are c_ast nodes with Var placeholders; a repeated Var must match equal
+    subtrees and Var('_') matches anything. A list pattern matches a run of
+    adjacent items in a block, member or case list. Replacements are
+    templates over the same Vars or functions of the bindings."""
+
+    def __init__(self, rules=None):
+        self.rules = peephole_rules() if rules is None else rules
+        self.hits = {}
+
+    def visit_FileAST(self, node):
+        self.types = declared_types(node)
+        self.parents = {id(n): (n, p) for n, p in walk(node)}
+
+        work = [n for n, _ in walk(node)]
+        while work:
+            n = work.pop()
+            n, parent = self.parents.get(id(n), (None, None))
+            if n is not None:
+                work.extend(self.rewrite(n, parent))
+        self.untag(node)
+
+    def rewrite(self, n, parent):
+        items = self.items(n)
+        for rule in self.rules:
+            if isinstance(rule.pattern, list):
+                if items is None:
+                    continue
+                k = len(rule.pattern)
+                for i in range(len(items) - k + 1):
+                    env = {}
+                    if match(rule.pattern, items[i:i + k], env) and (rule.where is None or rule.where(self, env, n)):
+                        new = instantiate(rule.replacement, env)
+                        self.update(items[i:i + k], new, n)
+                        items[i:i + k] = new
+                        self.hits[rule.name] = self.hits.get(rule.name, 0) + 1
+                        return [n, *new]
+            else:
+                env = {}
+                if match(rule.pattern, n, env) and (rule.where is None or rule.where(self, env, parent)):
+                    new = instantiate(rule.replacement, env)
+                    replace_child(parent, n, new)
+                    self.update([n], [new], parent)
+                    self.hits[rule.name] = self.hits.get(rule.name, 0) + 1
+                    return [parent, new]
+        return []
+
+    def items(self, n):
+        if isinstance(n, FileAST):
+            return n.ext
+        if isinstance(n, Compound):
+            return n.block_items
+        if isinstance(n, (Struct, Union)):
+            return n.decls
+        if isinstance(n, (Case, Default)):
+            return n.stmts
+
+    def update(self, old, new, parent):
+        for o in old:
+            for m, _ in walk(o):
+                self.parents.pop(id(m), None)
+        for o in new:
+            for m, p in walk(o, parent):
+                self.parents[id(m)] = (m, p)
+
+    def compatible(self, a, b):
+        if match(a, b, {}) or (is_int_literal(a) and is_int_literal(b)):
+            return True
+        ta, tb = self.type_of(a), self.type_of(b)
+        if ta is not None and tb is not None:
+            return self.same_type(ta, tb)
+        t, other = (ta, b) if ta is not None else (tb, a)
+        if t is None or not is_int_literal(other):
+            return False
+        t = self.resolve(t)
+        if isinstance(t, PtrDecl):
+            return other.value == '0'
+        return (isinstance(t, TypeDecl) and isinstance(t.type, IdentifierType)
+                and all(name in C_TYPES - {'void', 'float', 'double', '_Complex'} for name in t.type.names))
+
+    def type_of(self, e):
+        if isinstance(e, ID) and isinstance(e.name, Symbol):
+            return self.types.get(e.name)
+
+    def resolve(self, t):
+        while isinstance(t, TypeDecl) and isinstance(t.type, IdentifierType) and len(t.type.names) == 1:
+            name = t.type.names[0]
+            if name not in self.types:
+                break
+            t = self.types[name]
+        return t
+
+    def same_type(self, a, b):
+        if type(a) is not type(b) or isinstance(a, FuncDecl):
+            return False
+        if isinstance(a, TypeDecl):
+            return a.quals == b.quals and match(a.type, b.type, {})
+        if isinstance(a, ArrayDecl) and not match(a.dim, b.dim, {}):
+            return False
+        if isinstance(a, PtrDecl) and a.quals != b.quals:
+            return False
+        return self.same_type(a.type, b.type)
+
+    def untag(self, node):
+        uses = {}
+        for n, _ in walk(node):
+            if isinstance(n, (Struct, Union, Enum)) and isinstance(n.name, Symbol):
+                uses[n.name] = uses.get(n.name, 0) + 1
+        for n, _ in walk(node):
+            if not isinstance(n, DeclList):
+                continue
+            t = base_type(n.decls[0].type).type
+            if not isinstance(t, (Struct, Union, Enum)) or not isinstance(orig_name(t.name), Symbol):
+                continue
+            if getattr(t, 'values' if isinstance(t, Enum) else 'decls') is None:
+                continue
+            if sum(isinstance(m, type(t)) and m.name is t.name for m, _ in walk(n)) == uses[t.name]:
+                t.name = None
+                self.hits['anonymous tag'] = self.hits.get('anonymous tag', 0) + 1
+
+
+def peephole(s):
+    """
+    >>> peephole('int f(int c) { int a; int b = 1; int *p; while (1) { if (c) { a = 1; } else { a = 2; } b = b + 1; b = b * 3; a = c * a; if (a) return b; else return 0; } } int main() { return f(2); }')
+    int E(int A)
+    {
+      int B, C = 1, *D;
+      for (;;)
+      {
+        B = A ? 1 : 2;
+        ++C;
+        C *= 3;
+        B *= A;
+        return B ? C : 0;
+      }
+    <BLANKLINE>
+    }
+    <BLANKLINE>
+    int main()
+    {
+      return E(2);
+    }
+    <BLANKLINE>
+    braces: 2
+    declarations: 2
+    if else assignment: 1
+    if else return: 1
+    while (1): 1
+    x = x + 1: 1
+    x = x op y: 1
+    x = y op x: 1
+    >>> peephole('struct {int a;} a, b; int main(int c) { long l; unsigned int u; if (c) { if (c > 1) l = -1; } else l = u; if (c) l = 0; else l = c; return a.a + b.a; }')
+    struct 
+    {
+      int A;
+    } D, E;
+    int main(int A)
+    {
+      long B;
+      unsigned int C;
+      if (A)
+      {
+        if (A > 1)
+          B = -1;
+      }
+      else
+        B = C;
+      B = A ? 0 : A;
+      return D.A + E.A;
+    }
+    <BLANKLINE>
+    anonymous tag: 1
+    declarations: 1
+    if else assignment: 1
+    >>> peephole('int main(int a) { int b = 0; switch (a) { case 1: b = 1; b += 5; } return b; }')
+    int main(int A)
+    {
+      int B = 0;
+      switch (A)
+      {
+        case 1:
+          B = 1;
+          B += 5;
+    <BLANKLINE>
+      }
+    <BLANKLINE>
+      return B;
+    }
+    <BLANKLINE>
+    >>> peephole('void f(int c) { if (c) return; else return; } int main() { f(1); return 0; }')
+    void B(int A)
+    {
+      if (A)
+        return;
+      else
+        return;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      B(1);
+      return 0;
+    }
+    <BLANKLINE>
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    SymbolRenamer().visit(ast)
+    rewriter = Peephole()
+    rewriter.visit(ast)
+    print(CGenerator(reduce_parentheses=True).visit(ast), end='')
+    for name, n in sorted(rewriter.hits.items()):
+        print(f"{name}: {n}")
+
+
+class GotoCleaner(BaseVisitor):
+    """Simplifies the gotos and labels of each function. Statements are
+    walked backwards, tracking the labels, loop exits and loop ends that
+    are equivalent to the current position. A goto to the position that
+    follows it is dropped; one to the innermost loop exit or end becomes
+    break or continue; one to a label aliasing another is redirected to
+    the last label at that position. Labels left unreferenced are
+    removed. Only forward jumps are considered."""
+
+    def __init__(self):
+        self.hits = {}
+
+    def count(self, kind):
+        self.hits[kind] = self.hits.get(kind, 0) + 1
+
+    def visit_default(self, node):
+        pass
+
+    def visit_FileAST(self, node):
+        for d in node.ext:
+            self.visit(d)
+
+    def visit_FuncDef(self, node):
+        while True:
+            self.positions = {}
+            self.breaks = []
+            self.continues = []
+            hits = dict(self.hits)
+            self.statement(node.body, {})
+            self.remove_labels(node.body)
+            if hits == self.hits:
+                break
+
+    def block(self, items, after):
+        here = after
+        for i in reversed(range(len(items or ()))):
+            stmt, here = self.statement(items[i], here)
+            if stmt is None:
+                del items[i]
+            else:
+                items[i] = stmt
+        return here
+
+    def statement(self, node, after):
+        if isinstance(node, Goto):
+            target = self.positions.get(node.name)
+            if target is None:
+                return node, {}
+            if not target.keys().isdisjoint(after):
+                self.count('goto next')
+                return None, after
+            if self.breaks and self.breaks[-1][0] in target:
+                self.count('break')
+                return Break(), target
+            if self.continues and self.continues[-1][0] in target:
+                self.count('continue')
+                return Continue(), target
+            label = next(name for name in target if isinstance(name, str))
+            if label != node.name:
+                self.count('threaded')
+                node.name = label
+            return node, target
+        if isinstance(node, Label):
+            stmt, here = self.statement(node.stmt, after)
+            node.stmt = stmt or EmptyStatement()
+            here[node.name] = True
+            self.positions[node.name] = here
+            return node, here
+        if isinstance(node, Break):
+            return node, self.breaks[-1][1] if self.breaks else {}
+        if isinstance(node, Continue):
+            return node, self.continues[-1][1] if self.continues else {}
+        if isinstance(node, EmptyStatement):
+            return node, after
+        if isinstance(node, Compound):
+            return node, self.block(node.block_items, after)
+        if isinstance(node, (Case, Default)):
+            return node, self.block(node.stmts, after)
+        if isinstance(node, If):
+            node.iftrue = self.statement(node.iftrue, after)[0] or EmptyStatement()
+            if node.iffalse is not None:
+                node.iffalse = self.statement(node.iffalse, after)[0] or EmptyStatement()
+            return node, {}
+        if isinstance(node, (While, DoWhile, For, Switch)):
+            exit = ('break', len(self.positions), id(node))
+            after[exit] = True
+            self.breaks.append((exit, after))
+            if isinstance(node, Switch):
+                node.stmt = self.statement(node.stmt, after)[0] or EmptyStatement()
+            else:
+                end = ('continue', id(node))
+                self.continues.append((end, {end: True}))
+                node.stmt = self.statement(node.stmt, self.continues[-1][1])[0] or EmptyStatement()
+                self.continues.pop()
+            self.breaks.pop()
+            return node, {}
+        return node, {}
+
+    def remove_labels(self, body):
+        nodes = list(walk(body))
+        targets = {n.name for n, _ in nodes if isinstance(n, Goto)}
+        for n, p in reversed(nodes):
+            if isinstance(n, Label) and n.name not in targets:
+                if isinstance(n.stmt, EmptyStatement) and isinstance(p, Compound):
+                    p.block_items.remove(n)
+                else:
+                    replace_child(p, n, n.stmt)
+                self.count('label')
+
+
+def clean_gotos(s):
+    """
+    >>> clean_gotos('int main() { int i = 0; for (;;) { if (i < 10) { if (i % 3) { i += 2; goto b2; } goto b2; b2:; goto b1; } goto b0; b1:; i++; } b0:; return i; }')
+    int main()
+    {
+      int A = 0;
+      for (;;)
+      {
+        if (A < 10)
+        {
+          if (A % 3)
+          {
+            A += 2;
+          }
+          goto A;
+        }
+        break;
+        A:
+        ;
+    <BLANKLINE>
+        A++;
+      }
+    <BLANKLINE>
+      return A;
+    }
+    <BLANKLINE>
+    break: 1
+    goto next: 2
+    label: 2
+    >>> clean_gotos('int main() { int i = 0; while (i < 5) { i++; if (i == 2) goto next; if (i == 4) goto out; i++; next: ; } out: return i; }')
+    int main()
+    {
+      int A = 0;
+      while (A < 5)
+      {
+        A++;
+        if (A == 2)
+          continue;
+        if (A == 4)
+          break;
+        A++;
+      }
+    <BLANKLINE>
+      return A;
+    }
+    <BLANKLINE>
+    break: 1
+    continue: 1
+    label: 2
+    >>> clean_gotos('int main() { int i = 0; goto a; b: c: i++; a: goto c; }')
+    int main()
+    {
+      int A = 0;
+      goto A;
+      B:
+      A++;
+    <BLANKLINE>
+      A:
+      goto B;
+    <BLANKLINE>
+    }
+    <BLANKLINE>
+    label: 1
+    >>> clean_gotos('int main() { int i = 0; if (i) goto a; i++; goto b; a: b: c: return i; }')
+    int main()
+    {
+      int A = 0;
+      if (A)
+        goto A;
+      A++;
+      A:
+      return A;
+    <BLANKLINE>
+    }
+    <BLANKLINE>
+    goto next: 1
+    label: 2
+    threaded: 1
+    """
+    ast = same_ast(s)
+    cleaner = GotoCleaner()
+    cleaner.visit(ast)
+    SymbolRenamer().visit(ast)
+    print(CGenerator(reduce_parentheses=True).visit(ast), end='')
+    for kind, n in sorted(cleaner.hits.items()):
+        print(f"{kind}: {n}")
+
+
+class NameScope(NamedTuple):
+    parent: Any
+    depth: int
+    symbols: list
+    used: set
+
+
+class NameAllocator(BaseVisitor):
+    """Renames ordinary identifiers by coloring an interference graph.
+    Identifiers declared in one scope interfere with each other, and an
+    identifier interferes with those of an enclosing scope that are
+    referenced inside its scope. Identifiers are colored in decreasing
+    order of occurrences, taking the shortest name no neighbor holds, so
+    locals share one-letter names with the globals they do not see. The
+    names end up in an immutable mapping for the emitter, and the symbols
+    keep the names the renamer gave them."""
+
+    def __init__(self):
+        self.scopes = []
+        self.scope_of = {}
+        self.weights = {}
+        self.fixed = set()
+        self.names = EMPTY
+
+    def visit_FileAST(self, node):
+        root = self.enter(None)
+        for d in node.ext:
+            self.scan(d, root)
+        self.fixed.update(s.name for s in root.used if s not in self.scope_of)
+
+        edges = {s: set() for s in self.scope_of}
+        for scope in self.scopes:
+            for s in scope.symbols:
+                edges[s].update(scope.symbols)
+            for a in scope.used:
+                if a in self.scope_of and self.scope_of[a].depth < scope.depth:
+                    for s in scope.symbols:
+                        edges[a].add(s)
+                        edges[s].add(a)
+
+        names = {}
+        order = sorted(self.scope_of, key=lambda s: self.weights.get(s, 0), reverse=True)
+        for s in order:
+            taken = {names[n] for n in edges[s] if n is not s and n in names} | self.fixed
+            i = 0
+            while encode_symbol(i) in taken:
+                i += 1
+            names[s] = encode_symbol(i)
+        self.names = MappingProxyType(names)
+
+    def enter(self, parent):
+        scope = NameScope(parent, 0 if parent is None else parent.depth + 1, [], set())
+        self.scopes.append(scope)
+        return scope
+
+    def declare(self, name, scope):
+        if not isinstance(name, Symbol):
+            return
+        if name.orig_name == 'main' and scope.depth == 0:
+            self.fixed.add(name.name)
+            return
+        self.weights[name] = self.weights.get(name, 0) + 1
+        if name not in self.scope_of:
+            self.scope_of[name] = scope
+            scope.symbols.append(name)
+
+    def use(self, name, scope):
+        if not isinstance(name, Symbol):
+            self.fixed.add(name)
+            return
+        self.weights[name] = self.weights.get(name, 0) + 1
+        while scope is not None:
+            scope.used.add(name)
+            scope = scope.parent
+
+    def scan(self, node, scope):
+        if node is None:
+            return
+        if isinstance(node, FuncDef):
+            self.declare(node.decl.name and base_type(node.decl.type).declname, scope)
+            inner = self.enter(scope)
+            self.scan_function(node.decl.type, inner)
+            for d in node.param_decls or ():
+                self.scan(d, inner)
+            for item in node.body.block_items or ():
+                self.scan(item, inner)
+        elif isinstance(node, (Decl, Typedef)):
+            if node.name is not None:
+                self.declare(base_type(node.type).declname, scope)
+            self.scan_type(node.type, scope)
+            for child in (getattr(node, 'init', None), getattr(node, 'bitsize', None)):
+                self.scan(child, scope)
+        elif isinstance(node, (Compound, For)):
+            inner = self.enter(scope)
+            for _, child in node.children():
+                self.scan(child, inner)
+        elif isinstance(node, (TypeDecl, PtrDecl, ArrayDecl, FuncDecl, Typename)):
+            self.scan_type(node, scope)
+        elif isinstance(node, (Struct, Union)):
+            for d in node.decls or ():
+                self.scan_type(d.type, scope)
+                self.scan(d.bitsize, scope)
+        elif isinstance(node, Enumerator):
+            self.declare(node.name, scope)
+            self.scan(node.value, scope)
+        elif isinstance(node, ID):
+            self.use(node.name, scope)
+        elif isinstance(node, IdentifierType):
+            for name in node.names:
+                if isinstance(name, Symbol):
+                    self.use(name, scope)
+        elif isinstance(node, StructRef):
+            self.scan(node.name, scope)
+        elif isinstance(node, NamedInitializer):
+            for n in node.name:
+                if not isinstance(n, ID):
+                    self.scan(n, scope)
+            self.scan(node.expr, scope)
+        elif not isinstance(node, (Goto, Label)):
+            for _, child in node.children():
+                self.scan(child, scope)
+        elif isinstance(node, Label):
+            self.scan(node.stmt, scope)
+
+    def scan_type(self, node, scope):
+        if isinstance(node, TypeDecl):
+            self.scan(node.type, scope)
+        elif isinstance(node, FuncDecl):
+            self.scan_function(node, self.enter(scope))
+        elif isinstance(node, ArrayDecl):
+            self.scan_type(node.type, scope)
+            self.scan(node.dim, scope)
+        elif isinstance(node, (PtrDecl, Typename)):
+            self.scan_type(node.type, scope)
+        else:
+            self.scan(node, scope)
+
+    def scan_function(self, node, scope):
+        for param in node.args.params if node.args is not None else ():
+            self.scan(param, scope)
+        self.scan_type(node.type, scope)
+
+
+def allocate_names(s, renamed=False):
+    """
+    >>> allocate_names('int g; int h; int f(int x) { int y = x + 1; { int z = y; return z; } } int main() { int a; return f(g) + a + h + h; }')
+    int B;
+    int A;
+    int C(int A)
+    {
+      int B = A + 1;
+      {
+        int A = B;
+        return A;
+      }
+    }
+    <BLANKLINE>
+    int main()
+    {
+      int D;
+      return C(B) + D + A + A;
+    }
+    <BLANKLINE>
+    >>> allocate_names('int g; int f(int x) { int y = x; return y; } int main() { return f(g); }', renamed=True)
+    int A;
+    int B(int A)
+    {
+      int B = A;
+      return B;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      return B(A);
+    }
+    <BLANKLINE>
+    int C;
+    int D(int A)
+    {
+      int B = A;
+      return B;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      return D(C);
+    }
+    <BLANKLINE>
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    SymbolRenamer().visit(ast)
+    allocator = NameAllocator()
+    allocator.visit(ast)
+    print(CGenerator(reduce_parentheses=True, names=allocator.names).visit(ast), end='')
+    if renamed:
+        print(CGenerator(reduce_parentheses=True).visit(ast), end='')
+
+
+def declared_types(node):
+    types = {}
+    for n, _ in walk(node):
+        if isinstance(n, (Decl, Typedef)) and n.name is not None:
+            name = base_type(n.type).declname
+            if isinstance(name, Symbol):
+                types[name] = n.type
+    return types
+
+
+class LiteralType(NamedTuple):
+    rank: int
+    unsigned: bool
+    width: int
+
+    def __str__(self):
+        return 'unsigned ' * self.unsigned + 'long ' * self.rank + 'int'
+
+
+C_INTEGER = re.compile(r'(0[xX][0-9a-fA-F]+|0[0-7]*|[1-9]\d*)([uU]?(?:l|L|ll|LL)?|(?:l|L|ll|LL)[uU])')
+C_SUFFIXES = ('', 'u', 'l', 'ul', 'll', 'ull')
+
+
+def literal_types(bits, decimal, suffix):
+    """The types an integer literal may take, in order, as in C11 6.4.4.1."""
+    longs = suffix.count('l')
+    for rank in range(longs, 3):
+        width = bits[2 + rank]
+        if 'u' not in suffix:
+            yield LiteralType(rank, False, width)
+        if 'u' in suffix or not decimal:
+            yield LiteralType(rank, True, width)
+
+
+def literal_type(bits, value, decimal, suffix):
+    for t in literal_types(bits, decimal, suffix):
+        if value < 2 ** (t.width - (not t.unsigned)):
+            return t
+
+
+def literal_size(node):
+    return len(node.value) if isinstance(node, Constant) else 1 + literal_size(node.expr)
+
+
+def spell(value, base):
+    if base == 16:
+        return hex(value)
+    if base == 8:
+        return '0' + format(value, 'o') if value else '0'
+    return str(value)
+
+
+class LiteralRewriter(BaseVisitor):
+    """Respells integer and character constants in their shortest form for
+    the target widths. A constant keeps its type unless its context only
+    needs the value (assignment, initializer, return, subscript, case,
+    shift count, cast operand, condition), or it is an operand of an
+    arithmetic or comparison operator whose other operand has a known
+    integer type that gives the same common type. Casts of constants to
+    literal types are folded into the constant, and casts to types narrower
+    than int become int constants. Bit-fields promote by their width rather
+    than their declared type, so member accesses to them have no known
+    type."""
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.hits = {}
+
+    def count(self, kind):
+        self.hits[kind] = self.hits.get(kind, 0) + 1
+
+    def visit_FileAST(self, node):
+        self.types = declared_types(node)
+        self.bitfields = {base_type(n.type).declname for n, _ in walk(node) if isinstance(n, Decl) and n.bitsize is not None}
+        nodes = list(walk(node))
+        for n, p in reversed(nodes):
+            if isinstance(n, Cast) and self.parse(n.expr) is not None:
+                self.fold(n, p)
+        for n, p in list(walk(node)):
+            if isinstance(n, Constant):
+                self.shorten(n, p)
+
+    def parse(self, node):
+        if not isinstance(node, Constant):
+            return None
+        if node.type == 'char':
+            data = string_bytes('"' + node.value[1:-1] + '"')
+            if data is None or len(data) != 2 or data[0] > 127:
+                return None
+            return data[0], LiteralType(0, False, self.bits[2])
+        m = C_INTEGER.fullmatch(node.value)
+        if m is None:
+            return None
+        digits, suffix = m.group(1), m.group(2).lower()
+        value = int(digits, 16 if digits[:2].lower() == '0x' else 8 if digits[0] == '0' else 10)
+        t = literal_type(self.bits, value, not digits.startswith('0'), suffix)
+        if t is None:
+            return None
+        return value, t
+
+    def literal(self, value, allowed):
+        best = None
+        for base in (10, 16, 8):
+            digits = spell(value, base)
+            for suffix in C_SUFFIXES:
+                t = literal_type(self.bits, value, base == 10 and value != 0, suffix)
+                if t is not None and allowed(t) and (best is None or len(digits + suffix) < literal_size(best)):
+                    best = Constant(str(t), digits + suffix)
+        for rank in range(3):
+            t = LiteralType(rank, True, self.bits[2 + rank])
+            complement = 2 ** t.width - 1 - value
+            if not allowed(t) or not 0 <= complement < value:
+                continue
+            inner = self.literal(complement, lambda u: u == t)
+            if inner is not None and (best is None or literal_size(inner) + 1 < literal_size(best)):
+                best = UnaryOp('~', inner)
+        return best
+
+    def scalar(self, t):
+        while isinstance(t, TypeDecl) and isinstance(t.type, IdentifierType):
+            names = t.type.names
+            if len(names) == 1 and names[0] in self.types:
+                t = self.types[names[0]]
+                continue
+            if any(name not in C_TYPES or name in ('void', 'float', 'double', '_Complex') for name in names):
+                return None
+            unsigned = 'unsigned' in names or '_Bool' in names
+            if '_Bool' in names:
+                width = 1
+            elif 'char' in names:
+                width = self.bits[0]
+            elif 'short' in names:
+                width = self.bits[1]
+            else:
+                rank = min(names.count('long'), 2)
+                return self.bits[2 + rank], unsigned, LiteralType(rank, unsigned, self.bits[2 + rank])
+            return width, unsigned, LiteralType(0, unsigned and width == self.bits[2], self.bits[2])
+        return None
+
+    def integer_type(self, t):
+        s = self.scalar(t)
+        return s and s[2]
+
+    def type_of(self, e):
+        if isinstance(e, ID):
+            return self.types.get(e.name)
+        if isinstance(e, StructRef):
+            return None if e.field.name in self.bitfields else self.types.get(e.field.name)
+        if isinstance(e, Cast):
+            return e.to_type.type
+        if isinstance(e, ArrayRef) or isinstance(e, UnaryOp) and e.op == '*':
+            t = self.type_of(e.name if isinstance(e, ArrayRef) else e.expr)
+            while isinstance(t, TypeDecl) and isinstance(t.type, IdentifierType) and len(t.type.names) == 1 and t.type.names[0] in self.types:
+                t = self.types[t.type.names[0]]
+            return t.type if isinstance(t, (ArrayDecl, PtrDecl)) else None
+
+    def common(self, a, b):
+        if a == b or a.unsigned == b.unsigned:
+            return max(a, b)
+        u, s = (a, b) if a.unsigned else (b, a)
+        if u.rank >= s.rank:
+            return u
+        if s.width > u.width:
+            return s
+        return LiteralType(s.rank, True, s.width)
+
+    def fold(self, node, parent):
+        if isinstance(parent, UnaryOp) and parent.op in ('sizeof', '_Alignof'):
+            return
+        s = self.scalar(node.to_type.type)
+        if s is None:
+            return
+        width, unsigned, target = s
+        value, _ = self.parse(node.expr)
+        value = int(value != 0) if width == 1 else value % 2 ** width
+        if not unsigned and value >= 2 ** (width - 1):
+            return
+        new = self.literal(value, lambda u: u == target)
+        if new is None:
+            return
+        replace_child(parent, node, new)
+        self.count('cast')
+
+    def shorten(self, node, parent):
+        parsed = self.parse(node)
+        if parsed is None:
+            return
+        value, t = parsed
+        if self.value_context(node, parent):
+            allowed = lambda u: True
+        else:
+            other = None
+            if isinstance(parent, BinaryOp) and parent.op in C_BINARY and parent.op not in ('&&', '||', '<<', '>>'):
+                other = parent.right if parent.left is node else parent.left
+            elif isinstance(parent, Assignment) and parent.op[:-1] in C_COMPOUND_ASSIGN - {'<<', '>>'}:
+                other = parent.lvalue
+            other = other and self.integer_type(self.type_of(other))
+            if other is None:
+                allowed = lambda u: u == t
+            else:
+                allowed = lambda u: self.common(other, u) == self.common(other, t)
+        new = self.literal(value, allowed)
+        if new is None or literal_size(new) >= len(node.value):
+            return
+        replace_child(parent, node, new)
+        self.count('constant')
+
+    def value_context(self, node, parent):
+        if isinstance(parent, Assignment):
+            return parent.op in ('=', '<<=', '>>=') and parent.rvalue is node
+        if isinstance(parent, BinaryOp):
+            return parent.op in ('&&', '||') or parent.op in ('<<', '>>') and parent.right is node
+        if isinstance(parent, (If, While, DoWhile, For)):
+            return parent.cond is node
+        if isinstance(parent, TernaryOp):
+            return parent.cond is node
+        if isinstance(parent, ArrayRef):
+            return parent.subscript is node
+        if isinstance(parent, UnaryOp):
+            return parent.op == '!'
+        return isinstance(parent, (Decl, InitList, NamedInitializer, Return, Case, ArrayDecl, Cast))
+
+
+def shorten_literals(s, bits=(8, 16, 32, 64, 64, 64)):
+    """
+    >>> shorten_literals('unsigned long x; unsigned char c; int main() { x = 0xfffffffffffffffful; x = x + (unsigned long) 1ul; c = (unsigned char) 300; x = 3ul << 2ul; return x > 4294967296ul ? \\'a\\' : 0x10u; }')
+    unsigned long A;
+    unsigned char B;
+    int main()
+    {
+      A = ~0ul;
+      A = A + 1;
+      B = 44;
+      A = 3ul << 2;
+      return A > 4294967296 ? 97 : 16u;
+    }
+    <BLANKLINE>
+    cast: 2
+    constant: 6
+    >>> shorten_literals('unsigned long long y; int main() { y = y * 4294967296ull; return y & 0xffffffffull; }', (8, 16, 32, 32, 64, 32))
+    unsigned long long A;
+    int main()
+    {
+      A = A * 4294967296;
+      return A & (~0u);
+    }
+    <BLANKLINE>
+    constant: 2
+    >>> shorten_literals('struct { unsigned int f : 3; unsigned int g; } gb; int main() { return gb.f - 1u < gb.g - 1u; }')
+    struct 
+    {
+      unsigned int A : 3;
+      unsigned int B;
+    } A;
+    int main()
+    {
+      return A.A - 1u < A.B - 1;
+    }
+    <BLANKLINE>
+    constant: 1
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    SymbolRenamer().visit(ast)
+    rewriter = LiteralRewriter(bits)
+    rewriter.visit(ast)
+    print(CGenerator(reduce_parentheses=True).visit(ast), end='')
+    for kind, n in rewriter.hits.items():
+        print(f"{kind}: {n}")
+
+
+class ConstantPropagator(LiteralRewriter):
+    """Replaces uses of integer globals that are never written and of
+    enumerators by their values, and drops their declarations, when the
+    literals cost fewer bytes than the names and the declaration. A
+    substituted literal has the promoted type of the global. Globals whose
+    address is taken or whose size is asked for keep their names."""
+
+    def visit_FileAST(self, node):
+        self.types = declared_types(node)
+        nodes = list(walk(node))
+        inside = {id(m) for n, _ in nodes if isinstance(n, UnaryOp) and n.op in ('sizeof', '_Alignof') for m, _ in walk(n)}
+        self.uses, fixed = {}, set()
+        for n, p in nodes:
+            if not isinstance(n, ID):
+                continue
+            if isinstance(p, StructRef) and p.field is n or isinstance(p, NamedInitializer) and p.expr is not n:
+                continue
+            self.uses.setdefault(n.name, []).append((n, p))
+            if id(n) in inside or is_written(n, p):
+                fixed.add(n.name)
+
+        decls = {}
+        for d in node.ext:
+            if isinstance(d, Decl) and d.name is not None and not isinstance(d.type, FuncDecl):
+                decls.setdefault(base_type(d.type).declname, []).append(d)
+        removed = []
+        for name, ds in decls.items():
+            inits = [d.init for d in ds if d.init is not None]
+            if not isinstance(name, Symbol) or name in fixed or len(inits) != 1 or any('volatile' in d.quals for d in ds):
+                continue
+            t, value = self.scalar(ds[0].type), self.value(inits[0])
+            if t is None or value is None:
+                continue
+            width, unsigned, promoted = t
+            value %= 2 ** width
+            if width == 1:
+                value = int(value != 0)
+            elif not unsigned and value >= 2 ** (width - 1):
+                value -= 2 ** width
+            if self.substitute({name: self.constant(value, promoted)}, ds):
+                self.count('global')
+                removed.extend(ds)
+
+        for d in node.ext:
+            if not isinstance(d, Decl) or d.name is not None or not isinstance(d.type, Enum) or d.type.values is None:
+                continue
+            if d.type.name is not None and sum(isinstance(n, Enum) and n.name is d.type.name for n, _ in nodes) > 1:
+                continue
+            values, value = {}, -1
+            for e in d.type.values.enumerators:
+                value = value + 1 if e.value is None else self.value(e.value)
+                if value is None:
+                    break
+                values[e.name] = self.constant(value, LiteralType(0, False, self.bits[2]))
+            else:
+                if self.substitute(values, [d]):
+                    for _ in values:
+                        self.count('enumerator')
+                    removed.append(d)
+
+        node.ext = [d for d in node.ext if all(d is not r for r in removed)]
+
+    def value(self, e):
+        if isinstance(e, UnaryOp) and e.op in ('-', '~'):
+            parsed = self.parse(e.expr)
+            if parsed is None:
+                return None
+            value, t = parsed
+            value = -value if e.op == '-' else ~value
+            return value % 2 ** t.width if t.unsigned else value
+        parsed = self.parse(e)
+        return parsed and parsed[0]
+
+    def constant(self, value, t):
+        if value >= 0:
+            return self.literal(value, lambda u: u == t)
+        inner = self.literal(-value, lambda u: u == t)
+        return inner and UnaryOp('-', inner)
+
+    def substitute(self, literals, decls):
+        if any(literal is None for literal in literals.values()):
+            return False
+        generator = CGenerator(reduce_parentheses=True)
+        keep = sum(len(generator.visit(d)) + 2 for d in decls)
+        cost = 0
+        for name, literal in literals.items():
+            uses = len(self.uses.get(name, ()))
+            keep += uses * len(str(name))
+            cost += uses * len(generator.visit(literal))
+        if cost >= keep:
+            return False
+        for name, literal in literals.items():
+            for n, p in self.uses.get(name, ()):
+                replace_child(p, n, clone(literal))
+        return True
+
+
+def is_written(n, p):
+    if isinstance(p, Assignment):
+        return p.lvalue is n
+    return isinstance(p, UnaryOp) and p.op in ('&', '++', '--', 'p++', 'p--')
+
+
+def propagate_constants(s, bits=(8, 16, 32, 64, 64, 64)):
+    """
+    >>> propagate_constants('const unsigned long limit = 100000; unsigned char small = 300; int counter = 5; long s = -1;'
+    ...                     'enum { RED, GREEN = 4, BLUE }; enum color { CYAN, MAGENTA } shade;'
+    ...                     'int main() { counter++; return limit + small + counter + sizeof small + s + BLUE + MAGENTA + shade; }')
+    unsigned char A = 300;
+    int B = 5;
+    enum 
+    {
+      E,
+      D
+    } C;
+    int main()
+    {
+      B++;
+      return 100000ul + A + B + (sizeof(A)) + (-1l) + 5 + D + C;
+    }
+    <BLANKLINE>
+    global: 2
+    enumerator: 3
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    SymbolRenamer().visit(ast)
+    rewriter = ConstantPropagator(bits)
+    rewriter.visit(ast)
+    allocator = NameAllocator()
+    allocator.visit(ast)
+    print(CGenerator(reduce_parentheses=True, names=allocator.names).visit(ast), end='')
+    for kind, n in rewriter.hits.items():
+        print(f"{kind}: {n}")
+
+
+class DuplicateFolder(BaseVisitor):
+    """Folds function definitions and typedefs and struct and union
+    definitions that are identical up to renaming into the first of them.
+    Each candidate is reduced to a canonical form that numbers the symbols
+    it declares by first occurrence and names every other symbol by the
+    one it was folded into, and the forms are looked up in a dict. Folding
+    types can make their users identical, so rounds repeat until nothing
+    more folds. Functions with static locals keep their own state and
+    functions whose address is taken must keep distinct addresses, so
+    neither is folded."""
+
+    def __init__(self):
+        self.hits = {}
+        self.alias = {}
+
+    def visit_FileAST(self, node):
+        self.addressed = {n.name for n, p in walk(node)
+                          if isinstance(n, ID) and not (isinstance(p, FuncCall) and p.name is n)}
+        removed = set()
+        while True:
+            index, folded = {}, 0
+            for i, d in enumerate(node.ext):
+                if i in removed or self.defines(d) is None or not self.foldable(d):
+                    continue
+                key, symbols = self.canonical(d)
+                j = index.setdefault(key, i)
+                if j == i:
+                    continue
+                for a, b in zip(symbols, self.canonical(node.ext[j])[1]):
+                    self.alias[a] = b
+                removed.add(i)
+                self.count('function' if isinstance(d, FuncDef) else 'type')
+                folded += 1
+            if not folded:
+                break
+        for i, d in enumerate(node.ext):
+            if isinstance(d, Decl) and not isinstance(d, FuncDef) and d.init is None and self.defines(d, False) in self.alias:
+                removed.add(i)
+        node.ext = [d for i, d in enumerate(node.ext) if i not in removed]
+        for n, _ in walk(node):
+            for attr in n.attr_names:
+                value = getattr(n, attr)
+                if isinstance(value, list):
+                    setattr(n, attr, [self.find(v) for v in value])
+                elif isinstance(value, Symbol):
+                    setattr(n, attr, self.find(value))
+
+    def count(self, kind):
+        self.hits[kind] = self.hits.get(kind, 0) + 1
+
+    def find(self, sym):
+        while sym in self.alias:
+            sym = self.alias[sym]
+        return sym
+
+    def foldable(self, d):
+        if not isinstance(d, FuncDef):
+            return True
+        if self.defines(d) in self.addressed:
+            return False
+        return not any(isinstance(n, Decl) and 'static' in n.storage for n, _ in walk(d.body))
+
+    def defines(self, d, complete=True):
+        if isinstance(d, FuncDef):
+            name = base_type(d.decl.type).declname
+        elif isinstance(d, Typedef):
+            name = base_type(d.type).declname
+        elif isinstance(d, Decl) and d.name is None and isinstance(d.type, (Struct, Union)):
+            name = d.type.name if d.type.decls is not None or not complete else None
+        elif isinstance(d, Decl) and not complete:
+            name = base_type(d.type).declname
+        else:
+            return None
+        return name if isinstance(name, Symbol) else None
+
+    def canonical(self, node):
+        nodes = [n for n, _ in walk(node)]
+        local = {}
+        for n in nodes:
+            if isinstance(n, TypeDecl):
+                name = n.declname
+            elif isinstance(n, (Struct, Union)) and n.decls is not None or isinstance(n, Enum) and n.values is not None:
+                name = n.name
+            elif isinstance(n, (Label, Enumerator)):
+                name = n.name
+            else:
+                continue
+            if isinstance(name, Symbol):
+                local.setdefault(name, len(local))
+        key = []
+        for n in nodes:
+            key.append(n.__class__.__name__)
+            key.append(tuple(name for name, _ in n.children()))
+            for attr in n.attr_names:
+                if attr == 'name' and isinstance(n, (Decl, Typedef)):
+                    continue
+                value = getattr(n, attr)
+                if isinstance(value, list):
+                    key.append(tuple(self.canonical_value(v, local) for v in value))
+                else:
+                    key.append(self.canonical_value(value, local))
+        return tuple(key), list(local)
+
+    def canonical_value(self, value, local):
+        if isinstance(value, Symbol):
+            value = self.find(value)
+            return ('local', local[value]) if value in local else value
+        return value
+
+
+def fold_duplicates(s):
+    """
+    >>> fold_duplicates('typedef struct { unsigned long *p; } S; typedef struct { unsigned long *q; } T; typedef struct { unsigned long r; } U;'
+    ...                 'static unsigned long get_s(S s) { return *s.p; } static unsigned long get_t(T t) { return *t.q; }'
+    ...                 'int main() { unsigned long x = 1; S s; T t; U u; s.p = &x; t.q = &x; u.r = x; return get_s(s) + get_t(t) + u.r; }')
+    typedef struct 
+    {
+      unsigned long *A;
+    } A;
+    typedef struct 
+    {
+      unsigned long A;
+    } G;
+    unsigned long C(A B)
+    {
+      return *B.A;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      unsigned long B = 1;
+      A D;
+      A E;
+      G F;
+      D.A = &B;
+      E.A = &B;
+      F.A = B;
+      return C(D) + C(E) + F.A;
+    }
+    <BLANKLINE>
+    type: 1
+    function: 1
+    >>> fold_duplicates('static int next_a(void) { static int n; return ++n; } static int next_b(void) { static int n; return ++n; }'
+    ...                 'static int get_a(void) { return 1; } static int get_b(void) { return 1; }'
+    ...                 'int main() { next_a(); return next_a() + next_b() + (get_a == get_b); }')
+    int A(void)
+    {
+      static int A;
+      return ++A;
+    }
+    <BLANKLINE>
+    int B(void)
+    {
+      static int A;
+      return ++A;
+    }
+    <BLANKLINE>
+    int C(void)
+    {
+      return 1;
+    }
+    <BLANKLINE>
+    int D(void)
+    {
+      return 1;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      A();
+      return A() + B() + (C == D);
+    }
+    <BLANKLINE>
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    SymbolRenamer().visit(ast)
+    folder = DuplicateFolder()
+    folder.visit(ast)
+    allocator = NameAllocator()
+    allocator.visit(ast)
+    print(CGenerator(reduce_parentheses=True, names=allocator.names).visit(ast), end='')
+    for kind, n in folder.hits.items():
+        print(f"{kind}: {n}")
+
+
+C_CHARS = ('char', 'signed char', 'unsigned char')
+C_STRING_ESCAPES = {7: '\\a', 8: '\\b', 9: '\\t', 10: '\\n', 11: '\\v', 12: '\\f', 13: '\\r', 34: '\\"', 92: '\\\\'}
+
+
+def c_string(data):
+    r"""
+    >>> print(c_string(b'a"b\\\n\x00\x001??=\xff'))
+    "a\"b\\\n\0\0001?\?=\377"
+    """
+    out = []
+    for i, b in enumerate(data):
+        if b in C_STRING_ESCAPES:
+            out.append(C_STRING_ESCAPES[b])
+        elif b == 63 and i and data[i - 1] == 63:
+            out.append('\\?')
+        elif 32 <= b < 127:
+            out.append(chr(b))
+        elif i + 1 < len(data) and 48 <= data[i + 1] < 56:
+            out.append(f'\\{b:03o}')
+        else:
+            out.append(f'\\{b:o}')
+    return '"' + ''.join(out) + '"'
+
+
+class InitializerRewriter(BaseVisitor):
+    """Shortens initializer lists. Trailing zeros are dropped where the
+    size of the object does not depend on them, character arrays become
+    string literals when that is shorter, and runs of zeros inside arrays
+    are skipped with a designator. Lists relying on brace elision or mixing
+    in designators are only looked into, not changed."""
+
+    def __init__(self):
+        self.hits = {}
+
+    def count(self, kind, n=1):
+        self.hits[kind] = self.hits.get(kind, 0) + n
+
+    def visit_FileAST(self, node):
+        self.types = declared_types(node)
+        self.tags = {n.name: n for n, _ in walk(node)
+                     if isinstance(n, (Struct, Union)) and n.name is not None and n.decls is not None}
+        for n, _ in walk(node):
+            if isinstance(n, Decl) and isinstance(n.init, InitList):
+                n.init = self.initializer(n.init, n.type, self.sized(n.type))
+            elif isinstance(n, CompoundLiteral):
+                n.init = self.initializer(n.init, n.type.type, self.sized(n.type.type))
+
+    def resolve(self, t):
+        while isinstance(t, TypeDecl):
+            if isinstance(t.type, IdentifierType) and len(t.type.names) == 1 and t.type.names[0] in self.types:
+                t = self.types[t.type.names[0]]
+            elif isinstance(t.type, (Struct, Union)):
+                return t.type if t.type.decls is not None else self.tags.get(t.type.name)
+            else:
+                break
+        return t
+
+    def aggregate(self, t):
+        return isinstance(self.resolve(t), (ArrayDecl, Struct, Union))
+
+    def sized(self, t):
+        t = self.resolve(t)
+        return not isinstance(t, ArrayDecl) or t.dim is not None
+
+    def zero(self, e):
+        if isinstance(e, InitList):
+            return all(self.zero(x) for x in e.exprs)
+        if isinstance(e, Cast):
+            return self.zero(e.expr)
+        if not isinstance(e, Constant):
+            return False
+        if e.type == 'char':
+            return string_bytes('"' + e.value[1:-1] + '"') == b'\0\0'
+        m = C_INTEGER.fullmatch(e.value)
+        if m is not None:
+            return int(m.group(1), 16) == 0 if m.group(1)[:2].lower() == '0x' else set(m.group(1)) == {'0'}
+        try:
+            return float(e.value.rstrip('fFlL')) == 0
+        except ValueError:
+            return False
+
+    def byte(self, e):
+        sign = 1
+        if isinstance(e, UnaryOp) and e.op == '-':
+            sign, e = -1, e.expr
+        if not isinstance(e, Constant):
+            return None
+        if e.type == 'char':
+            data = string_bytes('"' + e.value[1:-1] + '"')
+            return data[0] * sign if data is not None and len(data) == 2 else None
+        m = C_INTEGER.fullmatch(e.value)
+        if m is None:
+            return None
+        digits = m.group(1)
+        value = sign * int(digits, 16 if digits[:2].lower() == '0x' else 8 if digits[0] == '0' else 10)
+        return value & 255 if -128 <= value < 256 else None
+
+    def size(self, e):
+        return len(CGenerator(reduce_parentheses=True).visit(e))
+
+    def initializer(self, init, t, sized):
+        if not isinstance(init, InitList):
+            return init
+        r = self.resolve(t)
+        if isinstance(r, ArrayDecl):
+            types = [r.type] * len(init.exprs)
+        elif isinstance(r, Struct) and len(init.exprs) <= len(r.decls):
+            types = [d.type for d in r.decls[:len(init.exprs)]]
+        elif isinstance(r, Union) and len(init.exprs) == 1:
+            types = [r.decls[0].type]
+        else:
+            return init
+
+        named = False
+        for i, (e, et) in enumerate(zip(init.exprs, types)):
+            if isinstance(e, NamedInitializer):
+                named = True
+                if len(e.name) == 1 and isinstance(r, ArrayDecl):
+                    e.expr = self.initializer(e.expr, r.type, True)
+                elif len(e.name) == 1 and isinstance(r, (Struct, Union)):
+                    for d in r.decls:
+                        if base_type(d.type).declname is e.name[0].name:
+                            e.expr = self.initializer(e.expr, d.type, True)
+            elif isinstance(e, InitList):
+                init.exprs[i] = self.initializer(e, et, True)
+            elif self.aggregate(et) and not (isinstance(e, Constant) and e.type == 'string'):
+                named = True
+        if named or isinstance(r, Union):
+            return init
+
+        exprs = list(init.exprs)
+        if not sized:
+            trailing = 0
+        else:
+            trailing = len(exprs)
+            while trailing and self.zero(exprs[trailing - 1]):
+                trailing -= 1
+            if trailing < len(exprs):
+                self.count('trailing zero', len(exprs) - max(trailing, 1))
+            exprs = exprs[:max(trailing, 1)]
+            if trailing == 0:
+                exprs = [Constant('int', '0')]
+
+        best = InitList(exprs, init.coord)
+        if isinstance(r, ArrayDecl):
+            best = self.skip_zeros(best)
+            string = self.string(init.exprs, r, sized)
+            if string is not None and self.size(string) < self.size(best):
+                self.count('string')
+                return string
+        return best
+
+    def skip_zeros(self, init):
+        exprs, i = [], 0
+        while i < len(init.exprs):
+            j = i
+            while j < len(init.exprs) and self.zero(init.exprs[j]):
+                j += 1
+            if i < j < len(init.exprs):
+                saved = sum(self.size(e) + 2 for e in init.exprs[i:j]) - len(f"[{j}] = ")
+                if saved > 0:
+                    exprs.append(NamedInitializer([Constant('int', str(j))], init.exprs[j]))
+                    self.count('designator')
+                    i = j + 1
+                    continue
+            exprs.extend(init.exprs[i:j + 1])
+            i = j + 1
+        return InitList(exprs, init.coord)
+
+    def string(self, exprs, r, sized):
+        t = self.resolve(r.type)
+        if not isinstance(t, TypeDecl) or not isinstance(t.type, IdentifierType) or ' '.join(t.type.names) not in C_CHARS:
+            return None
+        data = bytes(b for b in map(self.byte, exprs) if b is not None)
+        if len(data) != len(exprs):
+            return None
+        if r.dim is not None and sized:
+            m = C_DIM.fullmatch(getattr(r.dim, 'value', ''))
+            if m is None or int(m.group(1)) < len(data.rstrip(b'\0')):
+                return None
+            data = data.rstrip(b'\0')
+        elif data.endswith(b'\0'):
+            data = data[:-1]
+        else:
+            return None
+        return Constant('string', c_string(data))
+
+
+def compact_initializers(s):
+    r"""
+    >>> compact_initializers('int a[16] = {1, 2, 0, 0, 0, 0, 0, 0, 0, 7, 0, 0}; int b[] = {1, 0, 0};'
+    ...                      'unsigned char c[8] = {104, 105, 10, 0, 0}; char d[] = {49, 0, 50, 0};'
+    ...                      'struct P { int x; int y[3]; char *s; } p[2] = {{1, {0, 0, 0}, 0}, {0, {0, 0, 0}, (char *)0}};'
+    ...                      'int main() { return a[0] + b[0] + c[0] + d[0] + p[0].x; }')
+    int A[16] = {1, 2, [9] = 7};
+    int B[] = {1, 0, 0};
+    unsigned char C[8] = "hi\n";
+    char D[] = "1\0002";
+    struct 
+    {
+      int A;
+      int B[3];
+      char *C;
+    } E[2] = {{1}};
+    int main()
+    {
+      return A[0] + B[0] + C[0] + D[0] + E[0].A;
+    }
+    <BLANKLINE>
+    trailing zero: 13
+    designator: 1
+    string: 2
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    SymbolRenamer().visit(ast)
+    rewriter = InitializerRewriter()
+    rewriter.visit(ast)
+    print(CGenerator(reduce_parentheses=True).visit(ast), end='')
+    for kind, n in rewriter.hits.items():
+        print(f"{kind}: {n}")
+
+
+class DeclarationOrder(BaseVisitor):
+    """Reorders external declarations so that everything is defined before
+    it is used and drops the forward declarations this makes redundant.
+    Declarations that depend on each other in a cycle keep their original
+    order and forward declarations."""
+
+    def __init__(self):
+        self.hits = {}
+
+    def visit_FileAST(self, node):
+        items = node.ext
+        defines = [self.defines(d) for d in items]
+        definition = {}
+        for i, names in enumerate(defines):
+            for name, complete in names:
+                if name not in definition or complete and not definition[name][1]:
+                    definition[name] = (i, complete)
+        redundant = {i for i, names in enumerate(defines)
+                     if names and all(definition[name][0] != i for name, _ in names)}
+
+        kept = [i for i in range(len(items)) if i not in redundant]
+        deps = {i: {definition[name][0] for name in self.uses(items[i]) if name in definition} - {i}
+                for i in kept}
+        components = strongly_connected(kept, deps)
+        component = {i: c for c, members in enumerate(components) for i in members}
+        waiting = [len({component[j] for i in members for j in deps[i]} - {c}) for c, members in enumerate(components)]
+        users = {}
+        for c, members in enumerate(components):
+            for d in {component[j] for i in members for j in deps[i]} - {c}:
+                users.setdefault(d, []).append(c)
+
+        ready = [(min(members), c) for c, members in enumerate(components) if waiting[c] == 0]
+        heapify(ready)
+        ext = []
+        while ready:
+            _, c = heappop(ready)
+            members = set(components[c])
+            if len(members) > 1:
+                names = {name for i in members for name, _ in defines[i]}
+                members |= {i for i in redundant if any(name in names for name, _ in defines[i])}
+            ext.extend(items[i] for i in sorted(members))
+            for u in users.get(c, ()):
+                waiting[u] -= 1
+                if waiting[u] == 0:
+                    heappush(ready, (min(components[u]), u))
+
+        removed = len(items) - len(ext)
+        if removed:
+            self.hits['forward declaration'] = removed
+        node.ext = ext
+
+    def defines(self, node):
+        names = []
+        if isinstance(node, FuncDef):
+            names.append((base_type(node.decl.type).declname, True))
+        elif isinstance(node, Typedef):
+            names.append((base_type(node.type).declname, True))
+        elif isinstance(node, Decl) and node.name is not None:
+            names.append((base_type(node.type).declname, node.init is not None))
+        for n, _ in walk(node):
+            if isinstance(n, (Struct, Union)) and n.name is not None:
+                names.append((n.name, n.decls is not None))
+            elif isinstance(n, Enum) and n.name is not None:
+                names.append((n.name, n.values is not None))
+            elif isinstance(n, Enumerator):
+                names.append((n.name, True))
+        return names
+
+    def uses(self, node):
+        for n, p in walk(node):
+            if isinstance(n, ID):
+                if isinstance(p, StructRef) and p.field is n:
+                    continue
+                if isinstance(p, NamedInitializer) and p.expr is not n:
+                    continue
+                yield n.name
+            elif isinstance(n, IdentifierType):
+                yield from n.names
+            elif isinstance(n, (Struct, Union)) and n.decls is None or isinstance(n, Enum) and n.values is None:
+                yield n.name
+
+
+def strongly_connected(nodes, edges):
+    """Tarjan's algorithm without recursion. Components come out in
+    reverse topological order, each with its nodes in order.
+
+    >>> strongly_connected([0, 1, 2, 3], {0: {1}, 1: {2}, 2: {1}, 3: set()})
+    [[1, 2], [0], [3]]
+    """
+    index, low, stack, on_stack, components = {}, {}, [], set(), []
+    for root in nodes:
+        if root in index:
+            continue
+        work = [(root, iter(sorted(edges[root])))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            v, children = work[-1]
+            w = next(children, None)
+            if w is not None:
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(sorted(edges[w]))))
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+                continue
+            work.pop()
+            if work:
+                low[work[-1][0]] = min(low[work[-1][0]], low[v])
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(sorted(component))
+    return components
+
+
+def order_declarations(s):
+    """
+    >>> order_declarations('int f(int); int g(int); int main() { return f(1); } int f(int x) { return g(x) + 1; } int g(int x) { return x; }')
+    int C(int A)
+    {
+      return A;
+    }
+    <BLANKLINE>
+    int B(int A)
+    {
+      return C(A) + 1;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      return B(1);
+    }
+    <BLANKLINE>
+    forward declaration: 1
+    >>> order_declarations('struct P; struct P *head; int even(int); int odd(int n) { return n ? even(n - 1) : head != 0; }'
+    ...                    'int even(int n) { return n ? odd(n - 1) : 1; } struct P { struct P *next; }; int main() { return even(4) + !head->next; }')
+    struct A
+    {
+      struct A *A;
+    };
+    struct A *B;
+    int C(int);
+    int D(int A)
+    {
+      return A ? C(A - 1) : B != 0;
+    }
+    <BLANKLINE>
+    int C(int A)
+    {
+      return A ? D(A - 1) : 1;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      return C(4) + (!B->A);
+    }
+    <BLANKLINE>
+    forward declaration: 1
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    SymbolRenamer().visit(ast)
+    rewriter = DeclarationOrder()
+    rewriter.visit(ast)
+    print(CGenerator(reduce_parentheses=True).visit(ast), end='')
+    for kind, n in rewriter.hits.items():
+        print(f"{kind}: {n}")
+
+
+def is_void(t):
+    return isinstance(t, TypeDecl) and isinstance(t.type, IdentifierType) and t.type.names == ['void']
+
+
+class SignatureRewriter(BaseVisitor):
+    """Drops the return value of a function whose callers all discard it
+    and then the parameters the function no longer mentions, from its
+    definition, its prototypes and every call. Only functions that are called directly
+    everywhere are changed, and a parameter stays when any call passes it
+    an argument with side effects."""
+
+    def __init__(self):
+        self.hits = {}
+
+    def count(self, kind, n=1):
+        self.hits[kind] = self.hits.get(kind, 0) + n
+
+    def visit_FileAST(self, node):
+        nodes = list(walk(node))
+        self.parents = {id(n): p for n, p in nodes}
+        functions = {}
+        for d in node.ext:
+            if isinstance(d, FuncDef) and d.param_decls is None:
+                name = base_type(d.decl.type).declname
+                if isinstance(name, Symbol) and orig_name(name) != 'main' and not self.variadic(d.decl.type):
+                    functions[name] = d
+        calls = {name: [] for name in functions}
+        for n, p in nodes:
+            if isinstance(n, ID) and n.name in calls:
+                if isinstance(p, FuncCall) and p.name is n:
+                    calls[n.name].append(p)
+                else:
+                    functions.pop(n.name, None)
+        prototypes = {}
+        for n, _ in nodes:
+            if isinstance(n, Decl) and isinstance(n.type, FuncDecl):
+                prototypes.setdefault(base_type(n.type).declname, []).append(n.type)
+
+        for name, f in functions.items():
+            types = [t for t in prototypes.get(name, ()) if t is not f.decl.type]
+            if not is_void(f.decl.type.type) and all(self.discarded(call) for call in calls[name]):
+                self.return_value(f, types, calls[name])
+            self.parameters(f, types, calls[name])
+
+    def variadic(self, t):
+        return t.args is not None and any(isinstance(p, EllipsisParam) for p in t.args.params)
+
+    def parameters(self, f, types, calls):
+        params = f.decl.type.args.params if f.decl.type.args is not None else []
+        if len(params) == 1 and isinstance(params[0], Typename) and is_void(params[0].type):
+            return
+        signatures = [t for t in [f.decl.type, *types] if t.args is not None and len(t.args.params) == len(params)]
+        used = {n.name for node in [f.body, *(t.args for t in signatures)] for n, _ in walk(node) if isinstance(n, ID)}
+        unused = []
+        for i, p in enumerate(params):
+            if any(base_type(t.args.params[i].type).declname in used for t in signatures):
+                continue
+            if any(len(call.args.exprs) != len(params) or not is_pure(call.args.exprs[i]) for call in calls):
+                continue
+            unused.append(i)
+        if not unused:
+            return
+        for t in signatures:
+            t.args.params = [p for i, p in enumerate(t.args.params) if i not in unused]
+            if not t.args.params:
+                t.args = None
+        for call in calls:
+            call.args.exprs = [e for i, e in enumerate(call.args.exprs) if i not in unused]
+            if not call.args.exprs:
+                call.args = None
+        self.count('parameter', len(unused))
+
+    def discarded(self, call):
+        n, p = call, self.parents[id(call)]
+        if isinstance(p, Cast) and is_void(p.to_type.type):
+            n, p = p, self.parents[id(p)]
+        if isinstance(p, (Compound, Case, Default, Label)):
+            return True
+        if isinstance(p, (If, While, DoWhile, Switch, For)):
+            return p.cond is not n
+        return False
+
+    def return_value(self, f, types, calls):
+        for t in [f.decl.type, *types]:
+            t.type = TypeDecl(base_type(t).declname, [], None, IdentifierType(['void']))
+        f.decl.quals = []
+        for call in calls:
+            p = self.parents[id(call)]
+            if isinstance(p, Cast):
+                replace_child(self.parents[id(p)], p, call)
+        for n, p in list(walk(f.body)):
+            if not isinstance(n, Return) or n.expr is None:
+                continue
+            if is_pure(n.expr):
+                stmts = [Return(None)]
+            else:
+                stmts = [n.expr, Return(None)]
+            if isinstance(p, Compound):
+                i = [id(x) for x in p.block_items].index(id(n))
+                p.block_items[i:i + 1] = stmts
+            else:
+                replace_child(p, n, stmts[0] if len(stmts) == 1 else Compound(stmts))
+        items = f.body.block_items
+        if items and isinstance(items[-1], Return) and items[-1].expr is None:
+            items.pop()
+        self.count('return value')
+
+
+def rewrite_signatures(s):
+    """
+    >>> rewrite_signatures('extern int puts(const char *); int f(int a, int b, const char *c);'
+    ...                    'int f(int a, int b, const char *c) { if (a) return puts(c); return 1; }'
+    ...                    'int g(int x) { return x; } int h(int x) { return 0; } int (*p)(int) = h;'
+    ...                    'int main(void) { (void)f(1, 2, "x"); f(0, 3, "y"); return g(4) + p(5) + h(g(6)); }')
+    #include <stdio.h>
+    void D(int A, const char *C)
+    {
+      if (A)
+      {
+        puts(C);
+        return;
+      }
+    }
+    <BLANKLINE>
+    int E(int A)
+    {
+      return A;
+    }
+    <BLANKLINE>
+    int F(int A)
+    {
+      return 0;
+    }
+    <BLANKLINE>
+    int (*G)(int) = F;
+    int main(void)
+    {
+      D(1, "x");
+      D(0, "y");
+      return E(4) + G(5) + F(E(6));
+    }
+    <BLANKLINE>
+    return value: 1
+    parameter: 1
+    >>> rewrite_signatures('int ping(int n, int z); int pong(int n, int z) { if (n) ping(n - 1, 0); return n; }'
+    ...                    'int ping(int n, int z) { if (n) pong(n - 1, 1); return 2; } int main(void) { return ping(3, 7); }')
+    int C(int A);
+    void D(int A)
+    {
+      if (A)
+        C(A - 1);
     }
     <BLANKLINE>
-    >>> rewrite_struct_declaration('void f() { for (;;){ struct X {int a;} a,b; } }')
-    void f()
+    int C(int A)
     {
-      for (;;)
-      {
-        struct X
-        {
-          int a;
-        } a;
-        struct X b;
-      }
+      if (A)
+        D(A - 1);
+      return 2;
+    }
     <BLANKLINE>
+    int main(void)
+    {
+      return C(3);
     }
     <BLANKLINE>
-    >>> rewrite_struct_declaration('void f() { for (struct X {int a;} a,b;;); }')
-    void f()
+    return value: 1
+    parameter: 2
+    >>> rewrite_signatures('int f(int n, int a[n]) { return a[0]; } int main(void) { int b[3] = {0}; return f(3, b); }')
+    int C(int A, int B[A])
     {
-      for (struct X
-      {
-        int a;
-      } a, b;;)
-        ;
+      return B[0];
+    }
+    <BLANKLINE>
+    int main(void)
+    {
+      int A[3] = {0};
+      return C(3, A);
+    }
+    <BLANKLINE>
+    >>> rewrite_signatures('extern int puts(const char *); int f(const char *s, int n) { puts(s); return n; }'
+    ...                    'int main(void) { f("x", 1); return 0; }')
+    #include <stdio.h>
+    void C(const char *A)
+    {
+      puts(A);
+    }
     <BLANKLINE>
+    int main(void)
+    {
+      C("x");
+      return 0;
     }
     <BLANKLINE>
+    return value: 1
+    parameter: 1
     """
-    parser = CParser()
-    ast = parser.parse(s)
+    ast = same_ast(s)
     StructDeclarationRewriter().visit(ast)
-    generator = CGenerator()
-    print(generator.visit(ast), end='')
+    headers = SymbolRenamer().visit(ast)
+    rewriter = SignatureRewriter()
+    rewriter.visit(ast)
+    print("".join(f"#include <{h}>\n" for h in headers) + CGenerator(reduce_parentheses=True).visit(ast), end='')
+    for kind, n in rewriter.hits.items():
+        print(f"{kind}: {n}")
+
 
 class RecordingTable:
 
@@ -276,18 +2611,18 @@ class LocalCounter:
         return name
 
 
-BUILTIN_TYPES = {k: k for k in ('void', 'char','short', 'int', 'long', 'float', 'double')}
+BUILTIN_TYPES = MappingProxyType({k: k for k in ('void', 'char','short', 'int', 'long', 'float', 'double')})
 
 class Tables(NamedTuple):
     typedefs: Mapping[str, Any] = BUILTIN_TYPES
-    struct_names: Mapping[str, Symbol] = {}
-    struct_decls: Mapping[str, Struct] = {}
-    union_names: Mapping[str, Symbol] = {}
-    union_decls: Mapping[str, Union] = {}
-    enum_names: Mapping[str, Symbol] = {}
-    enum_decls: Mapping[str, Enum] = {}
-    decl_types: Mapping[str, Any] = {}
-    decl_inits: Mapping[str, Any] = {}
+    struct_names: Mapping[str, Symbol] = EMPTY
+    struct_decls: Mapping[str, Struct] = EMPTY
+    union_names: Mapping[str, Symbol] = EMPTY
+    union_decls: Mapping[str, Union] = EMPTY
+    enum_names: Mapping[str, Symbol] = EMPTY
+    enum_decls: Mapping[str, Enum] = EMPTY
+    decl_types: Mapping[str, Any] = EMPTY
+    decl_inits: Mapping[str, Any] = EMPTY
 
 class Counters(NamedTuple):
     decl: Any
@@ -303,13 +2638,170 @@ C_HEADERS = {
     "abort": "stdlib.h",
 }
 
+LIBC_HEADERS = [
+    "stdio.h", "stdlib.h", "string.h", "math.h", "ctype.h", "time.h", "setjmp.h", "signal.h",
+    "locale.h", "wchar.h", "wctype.h", "fenv.h", "inttypes.h", "errno.h", "unistd.h", "fcntl.h",
+    "strings.h", "sys/mman.h", "sys/stat.h", "sys/time.h", "sys/resource.h", "sys/wait.h",
+]
+LIBC_SKIP = re.compile(r'\b(?:__attribute__|__asm__|__asm)\s*\(')
+LIBC_BRACES = re.compile(r'\{[^{}]*\}')
+LIBC_FUNCTION = re.compile(r'([A-Za-z_]\w*)\s*\(')
+
+
+def skip_parens(text, i):
+    depth = 0
+    for j in range(i, len(text)):
+        if text[j] == '(':
+            depth += 1
+        elif text[j] == ')':
+            depth -= 1
+            if depth == 0:
+                return j + 1
+    return len(text)
+
+
+def header_functions(cc, header):
+    result = subprocess.run([cc, '-std=c11', '-E', '-P', '-x', 'c', '-'], input=f'#include <{header}>\n',
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return []
+    text, pieces, i = result.stdout, [], 0
+    while (m := LIBC_SKIP.search(text, i)) is not None:
+        pieces.append(text[i:m.start()])
+        i = skip_parens(text, m.end() - 1)
+    text = ''.join(pieces) + text[i:]
+    while (stripped := LIBC_BRACES.sub(' ', text)) != text:
+        text = stripped
+
+    names = []
+    for decl in text.split(';'):
+        decl = decl.strip()
+        if decl.startswith('typedef') or '=' in decl or not decl.endswith(')'):
+            continue
+        for m in LIBC_FUNCTION.finditer(decl):
+            if m.group(1) not in C_KEYWORDS:
+                names.append(m.group(1))
+                break
+    return names
+
+
+def header_sources(cc, headers):
+    """Modification times of every file that including headers reads, so
+    that an upgraded libc invalidates what was built from it."""
+    result = subprocess.run([cc, '-std=c11', '-M', '-MG', '-x', 'c', '-'], input=''.join(f'#include <{h}>\n' for h in headers),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return {}
+    sources = {}
+    for path in result.stdout.partition(':')[2].replace('\\\n', ' ').split():
+        try:
+            sources[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    return sources
+
+
+@lru_cache(maxsize=None)
+def libc_index(store=None):
+    """Maps libc functions to the headers declaring them, most common header
+    first. Built from the local system headers and cached in store, which
+    defaults to ~/.cache/cmin, until the headers change.
+
+    >>> with TemporaryDirectory() as store:
+    ...     index = libc_index(store)
+    ...     with open(os.path.join(store, "libc.json"), 'r') as f:
+    ...         cached = json.load(f)
+    ...     cached["index"]["memcpy"] = ["stale.h"]
+    ...     with open(os.path.join(store, "libc.json"), 'w') as f:
+    ...         json.dump(cached, f)
+    ...     hit = libc_index.__wrapped__(store)['memcpy']
+    ...     cached["sources"]["/nonexistent.h"] = 0
+    ...     with open(os.path.join(store, "libc.json"), 'w') as f:
+    ...         json.dump(cached, f)
+    ...     miss = libc_index.__wrapped__(store)['memcpy']
+    >>> index['memcpy'], index['printf'], hit, miss
+    (['string.h'], ['stdio.h'], ['stale.h'], ['string.h'])
+    """
+    cc = os.environ.get("CC", "cc")
+    if store is None:
+        store = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "cmin")
+    cache = os.path.join(store, "libc.json")
+    try:
+        sources = header_sources(cc, LIBC_HEADERS)
+    except OSError:
+        sources = {}
+    try:
+        with open(cache, 'r') as f:
+            cached = json.load(f)
+        if cached["cc"] == cc and cached["headers"] == LIBC_HEADERS and cached["sources"] == sources:
+            return cached["index"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = {name: [header] for name, header in C_HEADERS.items()}
+    try:
+        with ThreadPoolExecutor() as pool:
+            functions = list(pool.map(lambda h: header_functions(cc, h), LIBC_HEADERS))
+    except OSError:
+        return index
+    for header, names in zip(LIBC_HEADERS, functions):
+        for name in names:
+            headers = index.setdefault(name, [])
+            if header not in headers:
+                headers.append(header)
+
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        with open(cache + ".tmp", 'w') as f:
+            json.dump({"cc": cc, "headers": LIBC_HEADERS, "sources": sources, "index": index}, f)
+        os.replace(cache + ".tmp", cache)
+    except OSError:
+        pass
+    return index
+
+def orig_name(name):
+    return getattr(name, 'orig_name', name)
+
+
+def describe(node):
+    if isinstance(node, FuncDef):
+        return node.decl.name
+    if isinstance(node, Decl) and node.name is None:
+        t = node.type
+        kind = t.__class__.__name__.lower()
+        if t.name is None:
+            return kind
+        return f"{kind} {orig_name(t.name)}"
+    name = getattr(node, 'name', None)
+    if isinstance(name, str):
+        return name
+    return node.__class__.__name__
+
+
 class SymbolRenamer(BaseVisitor):
+    """Renames symbols and drops declarations main does not need. Given a
+    StructDeclarationRewriter, also splits struct declarations on the way
+    instead of walking the tree for it first."""
 
-    def __init__(self):
+    def __init__(self, structs=None):
         super().__init__()
+        self.structs = structs
         self.tables = Tables()
         self.counters = None
         self.global_counters = None
+        self.retention = {}
+        self.header_retention = {}
+        self.labels = {}
+        self.generation = 0
+        self.types = {}
+        self.typedecls = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def invalidate(self):
+        # resolved types depend on the typedef and tag names in scope
+        self.generation += 1
+        self.types.clear()
 
     @contextmanager
     def enter_child_scope(self):
@@ -318,14 +2810,18 @@ class SymbolRenamer(BaseVisitor):
         counters = self.counters
         if counters is not None:
             self.counters = Counters._make(map(LocalCounter, counters))
+        generation = self.generation
         try:
             yield
         finally:
             self.counters = counters
             self.tables = tables
+            if self.generation != generation:
+                self.invalidate()
 
     @contextmanager
     def record(self):
+        self.invalidate()
         for table in self.tables:
             table.table = RecordingTable(table.table)
         counters = self.global_counters
@@ -354,11 +2850,28 @@ class SymbolRenamer(BaseVisitor):
         return sym
 
     def get_typedecl(self, node):
-        while not isinstance(node, TypeDecl):
-            node = node.type
-        return node
+        entry = self.typedecls.get(id(node))
+        if entry is not None and entry[0] is node:
+            self.cache_hits += 1
+            return entry[1]
+        self.cache_misses += 1
+        t = node
+        while not isinstance(t, TypeDecl):
+            t = t.type
+        self.typedecls[id(node)] = (node, t)
+        return t
 
     def resolve_type(self, type):
+        entry = self.types.get((id(type), self.generation))
+        if entry is not None and entry[0] is type:
+            self.cache_hits += 1
+            return entry[1]
+        self.cache_misses += 1
+        t = self.lookup_type(type)
+        self.types[(id(type), self.generation)] = (type, t)
+        return t
+
+    def lookup_type(self, type):
         if isinstance(type, TypeDecl):
             type = type.type
 
@@ -391,6 +2904,8 @@ class SymbolRenamer(BaseVisitor):
         reference = []
         next_value = []
         include = set()
+        if self.structs is not None:
+            self.structs.rewrite(node.ext)
 
         with self.enter_child_scope():
             for d in node.ext:
@@ -478,7 +2993,7 @@ class SymbolRenamer(BaseVisitor):
                 for t in reference]
 
             main = declare_map[field_decl_types]['main']
-            visited = {main}
+            visited = {main: None}
             queue = [main]
 
             while queue:
@@ -486,7 +3001,7 @@ class SymbolRenamer(BaseVisitor):
                 init = init_map.get(n, n)
                 if init != n and init not in visited:
                     queue.append(init)
-                    visited.add(init)
+                    visited[init] = n
 
                 for d, i in zip(decl_fields, name_fields):
                     for name in declare[n][i] | reference[n][i]:
@@ -496,12 +3011,23 @@ class SymbolRenamer(BaseVisitor):
                         if x in visited:
                             continue
                         queue.append(x)
-                        visited.add(x)
+                        visited[x] = n
 
                 for x in reference_set[n]:
                     if x not in visited:
                         queue.append(x)
-                        visited.add(x)
+                        visited[x] = n
+
+            labels = [describe(d) for d in node.ext]
+            retention = {}
+            for i in visited:
+                path = []
+                x = i
+                while x is not None:
+                    if not path or path[-1] != labels[x]:
+                        path.append(labels[x])
+                    x = visited[x]
+                retention[i] = tuple(reversed(path))
 
             for i in range(len(node.ext)):
                 if i in visited:
@@ -509,6 +3035,7 @@ class SymbolRenamer(BaseVisitor):
                 node.ext[i] = None
 
 
+            externs = []
             for name, decl in self.tables.decl_types.table.items():
                 if not isinstance(decl, FuncDecl):
                     continue
@@ -524,13 +3051,28 @@ class SymbolRenamer(BaseVisitor):
                 if "extern" not in d.storage:
                     continue
 
-                header = C_HEADERS.get(name, None)
-                if header is None:
+                headers = libc_index().get(name, None)
+                if headers is None:
                     continue
+                externs.append((i, headers))
 
-                node.ext[i] = None
+            generator = CGenerator(reduce_parentheses=True)
+            prototypes = {}
+            for i, headers in externs:
+                d = node.ext[i]
+                cost = len(generator.visit(d)) + 2 - sum(len(s) + 1 for s in d.storage)
+                prototypes.setdefault(headers[0], []).append((i, cost))
+
+            for header, protos in prototypes.items():
+                if len(f"#include <{header}>\n") > sum(cost for _, cost in protos):
+                    continue
+                self.header_retention[header] = retention[protos[0][0]]
                 include.add(header)
 
+            for i, headers in externs:
+                if any(h in include for h in headers):
+                    node.ext[i] = None
+
             next_value = [ next_value[i]
                            for i, n in enumerate(node.ext)
                            if n is not None]
@@ -597,6 +3139,9 @@ class SymbolRenamer(BaseVisitor):
                 for d, t in zip(declare_map, zip(*reference))
             ]
 
+            self.retention = {id(n): retention[i]
+                              for i, n in enumerate(node.ext)
+                              if n is not None}
             node.ext = [n for n in node.ext if n is not None]
             for d in node.ext:
                 if isinstance(d, FuncDef):
@@ -635,7 +3180,7 @@ class SymbolRenamer(BaseVisitor):
                             s = getattr(self.tables, f"{n}_decls")[c]
                             s.name = None
 
-        return include
+        return sorted(include)
 
 
     def visit_Decl(self, node):
@@ -706,6 +3251,7 @@ class SymbolRenamer(BaseVisitor):
 
     def visit_Typedef(self, node):
         self.tables.typedefs[node.name] = node.type
+        self.invalidate()
         self.visit(node.type)
         decl = self.get_typedecl(node.type)
         decl.declname = self.create_symbol(node.name)
@@ -741,8 +3287,11 @@ class SymbolRenamer(BaseVisitor):
             with self.enter_child_scope():
                 if node.decl.type.args:
                     self.visit(node.decl.type.args)
-                self.labels = {}
-                self.visit(node.body)
+                labels, self.labels = self.labels, {}
+                try:
+                    self.visit(node.body)
+                finally:
+                    self.labels = labels
 
     def visit_Enum(self, node):
         name = node.name
@@ -789,6 +3338,7 @@ class SymbolRenamer(BaseVisitor):
             else:
                 sym = self.create_symbol(name, 'struct')
                 self.tables.struct_names[name] = sym
+                self.invalidate()
                 node.name = sym
 
         if node.decls is None:
@@ -797,6 +3347,7 @@ class SymbolRenamer(BaseVisitor):
         if name is not None:
             assert name not in self.tables.struct_decls.table, f"redefinition of struct {name}"
             self.tables.struct_decls[name] = node
+            self.invalidate()
 
     def visit_Union(self, node):
         for i, decl in enumerate(node.decls or ()):
@@ -815,6 +3366,7 @@ class SymbolRenamer(BaseVisitor):
             else:
                 sym = self.create_symbol(name, 'union')
                 self.tables.union_names[name] = sym
+                self.invalidate()
                 node.name = sym
 
         if node.decls is None:
@@ -823,6 +3375,7 @@ class SymbolRenamer(BaseVisitor):
         if name is not None:
             assert name not in self.tables.union_decls.table, f"redefinition of union {name}"
             self.tables.union_decls[name] = node
+            self.invalidate()
 
     def visit_StructRef(self, node):
         t = self.resolve_type(self.visit(node.name))
@@ -853,6 +3406,8 @@ class SymbolRenamer(BaseVisitor):
             node.names = [self.get_typedecl(t).declname]
 
     def visit_Compound(self, node):
+        if self.structs is not None and node.block_items is not None:
+            self.structs.rewrite(node.block_items)
         with self.enter_child_scope():
             for item in node.block_items or ():
                 self.visit(item)
@@ -889,6 +3444,8 @@ class SymbolRenamer(BaseVisitor):
                 self.visit(node.stmt)
 
     def visit_DeclList(self, node):
+        if self.structs is not None:
+            self.structs.rewrite(node.decls)
         for item in node.decls or ():
             self.visit(item)
 
@@ -1440,9 +3997,19 @@ def rename_ids(s):
       B A;
     }
     <BLANKLINE>
+    >>> rename_ids('extern void *memcpy(void *, const void *, unsigned long); extern void abort(void); int main() { char a[2], b[2]; memcpy(a, b, 2); abort(); }')
+    #include <string.h>
+    void abort(void);
+    int main()
+    {
+      char A[2];
+      char B[2];
+      memcpy(A, B, 2);
+      abort();
+    }
+    <BLANKLINE>
     """
-    parser = CParser()
-    ast = parser.parse(s)
+    ast = same_ast(s)
     StructDeclarationRewriter().visit(ast)
     headers = SymbolRenamer().visit(ast)
     generator = CGenerator()
@@ -1450,15 +4017,88 @@ def rename_ids(s):
     ccode = "".join(f"#include <{h}>\n" for h in headers) + ccode
     print(ccode, end='')
 
+def report(ast, headers, renamer, generator, top=10, file=None, pool=None, rewriters=()):
+    rows = []
+    for h in headers:
+        rows.append((len(f"#include <{h}>\n"), f"#include <{h}>", renamer.header_retention[h]))
+    for d in ast.ext:
+        paths = [renamer.retention.get(id(x), (describe(x),)) for x in declarators(d)]
+        size = len(generator.visit(FileAST([d])))
+        rows.append((size, ', '.join(path[-1] for path in paths), paths[0]))
+
+    total = sum(size for size, _, _ in rows)
+    rows.sort(key=lambda row: row[0], reverse=True)
+    for size, name, path in rows[:top]:
+        print(f"{size:>6}  {name}", file=file)
+        if len(path) > 1:
+            print(f"        {' -> '.join(path)}", file=file)
+    print(f"{total:>6}  total in {len(rows)} declarations", file=file)
+    print(f"{renamer.cache_hits:>6}  type cache hits, {renamer.cache_misses} misses", file=file)
+    for kind, (n, saved) in (pool.saved if pool is not None else {}).items():
+        print(f"{saved:>6}  saved on {n} {kind} string literals", file=file)
+    for rewriter in rewriters:
+        for name, n in rewriter.hits.items():
+            print(f"{n:>6}  {name} rewrites", file=file)
+
+
+def report_sizes(s, top=10):
+    """
+    >>> report_sizes('int a[] = {1,2,3}; int b; int f() { return a[0]; } int g() { return f(); } int main() { g(); }')
+        28  f
+            main -> g -> f
+        27  g
+            main -> g
+        23  main
+        21  a
+            main -> g -> f -> a
+        99  total in 4 declarations
+         6  type cache hits, 9 misses
+    >>> report_sizes('extern int printf(const char *, ...); int main() { printf("OK"); }', top=1)
+        32  main
+        51  total in 2 declarations
+         1  type cache hits, 3 misses
+    >>> report_sizes('extern int printf(const char *, ...); void f() { printf("OK"); } int main() { f(); }')
+        30  f
+            main -> f
+        23  main
+        19  #include <stdio.h>
+            main -> f -> printf
+        72  total in 3 declarations
+         3  type cache hits, 5 misses
+    >>> report_sizes('struct S { int x; }; typedef struct S T; T a; int main() { return a; }', top=2)
+        28  main
+        23  struct S
+            main -> a -> T -> struct S
+        76  total in 4 declarations
+         4  type cache hits, 4 misses
+    >>> report_sizes('struct P { int x; }; struct Q { struct P p; }; struct R { struct Q q[2]; }; typedef struct R T; T t;'
+    ...              'int main() { T u = t; return u.q[0].p.x + u.q[1].p.x + t.q[0].p.x; }', top=1)
+        76  main
+       183  total in 6 declarations
+        25  type cache hits, 13 misses
+    >>> report_sizes('struct A { int a; }; struct B { int b; }; typedef struct A T; T x;'
+    ...              'int main() { x.a = 0; { typedef struct B T; T y; y.b = 1; } return x.a; }', top=1)
+        95  main
+       166  total in 5 declarations
+        10  type cache hits, 13 misses
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    renamer = SymbolRenamer()
+    headers = renamer.visit(ast)
+    generator = CGenerator()
+    report(ast, headers, renamer, generator, top)
+
+
 def define_inttypes(bits):
-    names = ['char', 'short', 'int', 'long', 'longlong']
+    names = ['char', 'short', 'int', 'long', 'long long']
     for b in [8,16,32,64]:
         name = names[bits.index(b)]
         yield f"#define uint{b}_t unsigned {name}\n"
         yield f"#define int{b}_t signed {name}\n"
         if name == 'long':
             yield f"#define UINT{b}_C(c) c##ul\n"
-        elif name == 'longlong':
+        elif name == 'long long':
             yield f"#define UINT{b}_C(c) c##ull\n"
         else:
             yield f"#define UINT{b}_C(c) c##u\n"
@@ -1475,40 +4115,1787 @@ def mtime(filename):
         pass
 
 
-def main(bits, input, output=None):
-    if output is not None:
-        time_i = mtime(input)
-        assert time_i is not None, f"{input} not found"
-        time_o = mtime(output)
-        if time_o is not None and time_i < time_o:
+class CaseResult(NamedTuple):
+    status: str
+    seconds: float
+
+    def __str__(self):
+        return f"{self.status} {self.seconds*1000:.1f}ms"
+
+
+def compile_c(code, directory, name, include_dirs=(), flags=("-O2",)):
+    source = os.path.join(directory, f"{name}.c")
+    exe = os.path.join(directory, name)
+    with open(source, "w") as f:
+        f.write(code)
+    cc = os.environ.get("CC", "cc")
+    args = [cc, "-std=c11", *flags, "-w"]
+    args += [f"-I{d}" for d in include_dirs]
+    args += ["-o", exe, source, "-lm"]
+    proc = subprocess.run(args, stderr=subprocess.PIPE, text=True)
+    assert proc.returncode == 0, f"{name}: compile error\n{proc.stderr}"
+    return exe
+
+
+def run_case(exe, case, timeout):
+    with open(os.path.join(case, "in"), "rb") as f:
+        stdin = f.read()
+    with open(os.path.join(case, "out"), "rb") as f:
+        expected = f.read()
+
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run([exe], input=stdin, stdout=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return CaseResult("TLE", time.perf_counter() - start)
+    seconds = time.perf_counter() - start
+
+    if proc.returncode != 0:
+        return CaseResult("RE", seconds)
+    if proc.stdout != expected:
+        return CaseResult("WA", seconds)
+    return CaseResult("OK", seconds)
+
+
+def verify(cases_dir, programs, timeout=10, file=None):
+    cases = sorted(e.name for e in os.scandir(cases_dir) if e.is_dir())
+    assert cases, f"no cases in {cases_dir}"
+
+    with TemporaryDirectory() as tmp, ThreadPoolExecutor() as pool:
+        def build(program):
+            name, code, *include_dirs = program
+            return compile_c(code, tmp, name, include_dirs)
+
+        exes = list(pool.map(build, programs))
+        names = [p[0] for p in programs]
+        futures = [[pool.submit(run_case, exe, os.path.join(cases_dir, case), timeout)
+                    for case in cases]
+                   for exe in exes]
+        results = [[f.result() for f in fs] for fs in futures]
+
+    width = max(map(len, cases + ["case"]))
+    print(f"{'case':<{width}}" + "".join(f"  {n:<12}" for n in names).rstrip(), file=file)
+    for case, row in zip(cases, zip(*results)):
+        print(f"{case:<{width}}" + "".join(f"  {str(r):<12}" for r in row).rstrip(), file=file)
+
+    return sum(r.status != "OK" for rs in results for r in rs)
+
+
+def verify_c(s, cases):
+    """
+    >>> verify_c('extern int scanf(const char *, ...); extern int printf(const char *, ...); int main() { int a; scanf("%d", &a); printf("%d\\\\n", a * 2); }', ['1', '2']) # doctest: +ELLIPSIS
+    case  original      minified
+    0     OK ...OK ...ms
+    1     OK ...OK ...ms
+    0
+    >>> verify_c('extern int printf(const char *, ...); int main() { printf("2\\\\n"); }', ['1', '2']) # doctest: +ELLIPSIS
+    case  original      minified
+    0     OK ...OK ...ms
+    1     WA ...WA ...ms
+    2
+    >>> verify_c('extern void abort(); int main() { abort(); }', ['1']) # doctest: +ELLIPSIS
+    case  original      minified
+    0     RE ...RE ...ms
+    2
+    """
+    ast = same_ast(s)
+    StructDeclarationRewriter().visit(ast)
+    headers = SymbolRenamer().visit(ast)
+    generator = CGenerator()
+    ccode = generator.visit(ast)
+    ccode = "".join(f"#include <{h}>\n" for h in headers) + ccode
+
+    with TemporaryDirectory() as tests:
+        for i, n in enumerate(cases):
+            case = os.path.join(tests, str(i))
+            os.mkdir(case)
+            with open(os.path.join(case, "in"), "w") as f:
+                f.write(f"{n}\n")
+            with open(os.path.join(case, "out"), "w") as f:
+                f.write(f"{int(n)*2}\n")
+        print(verify(tests, [("original", s), ("minified", ccode)]))
+
+
+def group_targets(targets):
+    """
+    >>> for prolog, configs in group_targets([('8,16,32,64,64,64', 'a.c'), ('8,16,32,64,64,64', 'b.c'), ('8,16,32,32,64,32', 'c.c'), ('8,16,32,64,64,64', None)]).items():
+    ...     print(prolog.splitlines()[-1], configs)
+    #define intptr_t signed long {(8, 16, 32, 64, 64, 64): ['a.c', 'b.c', None]}
+    #define intptr_t signed int {(8, 16, 32, 32, 64, 32): ['c.c']}
+    >>> for prolog, configs in group_targets([('8,16,32,64,64,64', 'a.c'), ('8,16,32,64,128,64', 'b.c')]).items():
+    ...     print(prolog.splitlines()[-1], configs)
+    #define intptr_t signed long {(8, 16, 32, 64, 64, 64): ['a.c'], (8, 16, 32, 64, 128, 64): ['b.c']}
+    """
+    groups = {}
+    for bits, output in targets:
+        bits = tuple(map(int, bits.split(",")))
+        prolog = ''.join(define_inttypes(bits))
+        groups.setdefault(prolog, {}).setdefault(bits, []).append(output)
+    return groups
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Macro(NamedTuple):
+    params: Any
+    body: Any
+
+
+PP_COMMENT = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|//[^\n]*|/\*.*?\*/', re.S)
+PP_TOKEN = re.compile(r'[A-Za-z_]\w*|\.?\d(?:[eEpP][+-]|[\w.])*|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|\s+|##|.')
+PP_DIRECTIVE = re.compile(r'\s*#\s*(\w*)\s*(.*?)\s*$')
+PP_DEFINE = re.compile(r'([A-Za-z_]\w*)(?:\(([^)]*)\))?\s*(.*)$')
+PP_DEFINED = re.compile(r'(!?)\s*defined\s*(?:\(\s*(\w+)\s*\)|(\w+))$')
+
+
+def strip_spaces(tokens):
+    i, j = 0, len(tokens)
+    while i < j and tokens[i][0].isspace():
+        i += 1
+    while j > i and tokens[j-1][0].isspace():
+        j -= 1
+    return tokens[i:j]
+
+
+class ZigPreprocessor:
+    """Preprocessor for the directives Zig's C backend, zig.h and
+    define_inttypes emit. Raises Unsupported on anything else."""
+
+    def __init__(self, paths=()):
+        self.paths = list(paths)
+        self.macros = {}
+        self.once = set()
+        self.out = []
+
+    def parse(self, text, source):
+        if source in self.once:
             return
+        text = PP_COMMENT.sub(self.strip_comment, text.replace('\\\n', ''))
+        self.out.append(f'#line 1 "{source}"\n')
+
+        skipping = []
+        for lineno, line in enumerate(text.split('\n'), 1):
+            m = PP_DIRECTIVE.match(line)
+            if m is None:
+                if any(skipping):
+                    self.out.append('\n')
+                else:
+                    self.out.append(self.expand_line(line))
+                continue
+
+            directive, rest = m.groups()
+            if directive in ('ifdef', 'ifndef'):
+                skipping.append((rest in self.macros) == (directive == 'ifndef'))
+            elif directive == 'if':
+                d = PP_DEFINED.match(rest)
+                if d is None:
+                    raise Unsupported(f'#if {rest}')
+                skipping.append(((d.group(2) or d.group(3)) in self.macros) == bool(d.group(1)))
+            elif directive == 'else':
+                if not skipping:
+                    raise Unsupported('#else without #if')
+                skipping[-1] = not skipping[-1]
+            elif directive == 'endif':
+                if not skipping:
+                    raise Unsupported('#endif without #if')
+                skipping.pop()
+            elif any(skipping):
+                pass
+            elif directive == 'define':
+                self.define(rest)
+            elif directive == 'undef':
+                self.macros.pop(rest, None)
+            elif directive == 'include':
+                self.include(rest, source)
+                self.out.append(f'#line {lineno + 1} "{source}"\n')
+                continue
+            elif directive == 'pragma':
+                if rest == 'once':
+                    self.once.add(source)
+                else:
+                    self.out.append(line + '\n')
+                    continue
+            elif directive != '':
+                raise Unsupported(f'#{directive}')
+            self.out.append('\n')
+
+        if skipping:
+            raise Unsupported('unterminated #if')
+
+    def strip_comment(self, m):
+        s = m.group()
+        if s[0] in '"\'':
+            return s
+        return '\n' * s.count('\n') or ' '
+
+    def define(self, rest):
+        m = PP_DEFINE.match(rest)
+        if m is None:
+            raise Unsupported(f'#define {rest}')
+        name, params, body = m.groups()
+        body = PP_TOKEN.findall(body)
+        if params is not None:
+            params = [p.strip() for p in params.split(',')] if params.strip() else []
+            if '...' in params or '#' in body:
+                raise Unsupported(f'#define {rest}')
+        self.macros[name] = Macro(params, body)
+
+    def include(self, rest, source):
+        if not (len(rest) > 2 and rest[0] == rest[-1] == '"'):
+            raise Unsupported(f'#include {rest}')
+        name = rest[1:-1]
+        for d in [os.path.dirname(source)] + self.paths:
+            path = os.path.join(d, name)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    self.parse(f.read(), path)
+                return
+        raise Unsupported(f'#include {rest}')
+
+    def expand_line(self, line):
+        tokens = PP_TOKEN.findall(line)
+        if not any(t in self.macros for t in tokens):
+            return line + '\n'
+        return ''.join(t for t, _ in self.expand([(t, frozenset()) for t in tokens])) + '\n'
+
+    def expand(self, tokens):
+        stack = tokens[::-1]
+        out = []
+        while stack:
+            t, hide = stack.pop()
+            m = self.macros.get(t)
+            if m is None or t in hide:
+                out.append((t, hide))
+                continue
+
+            if m.params is None:
+                hide = hide | {t}
+                stack.extend((b, hide) for b in reversed(m.body))
+                continue
+
+            k = len(stack) - 1
+            while k >= 0 and stack[k][0].isspace():
+                k -= 1
+            if k < 0 or stack[k][0] != '(':
+                out.append((t, hide))
+                continue
+
+            del stack[k:]
+            depth = 1
+            args = [[]]
+            while True:
+                if not stack:
+                    raise Unsupported(f'unterminated call of {t}')
+                a = stack.pop()
+                if a[0] == '(':
+                    depth += 1
+                elif a[0] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif a[0] == ',' and depth == 1:
+                    args.append([])
+                    continue
+                args[-1].append(a)
+
+            if args == [[]] and not m.params:
+                args = []
+            if len(args) != len(m.params):
+                raise Unsupported(f'wrong number of arguments to {t}')
+            hide = (hide & a[1]) | {t}
+            stack.extend(reversed(self.substitute(m, map(strip_spaces, args), hide)))
+        return out
+
+    def substitute(self, macro, args, hide):
+        args = dict(zip(macro.params, args))
+        body = macro.body
+        out = []
+        paste = False
+        for i, t in enumerate(body):
+            if t.isspace() and (paste or (i + 1 < len(body) and body[i+1] == '##')):
+                continue
+            if t == '##':
+                paste = True
+                continue
+
+            if t not in args:
+                tokens = [(t, frozenset())]
+            elif paste or (i + 1 < len(body) and body[i+1] == '##'):
+                tokens = args[t]
+            else:
+                tokens = self.expand(args[t])
 
-    cpp = Preprocessor()
-    cpp.add_path(os.path.dirname(__file__))
+            if paste and out and tokens:
+                text = out.pop()[0] + tokens[0][0]
+                tokens = [(p, frozenset()) for p in PP_TOKEN.findall(text)] + tokens[1:]
+            paste = False
+            out.extend(tokens)
 
-    with open(input, 'r') as f:
-        code = f.read()
-    prolog = ''.join(define_inttypes(list(map(int, bits.split(",")))))
+        return [(t, h | hide) for t, h in out]
+
+    def write(self, buf):
+        buf.write(''.join(self.out))
+
+
+def fast_preprocess(s):
+    """
+    >>> fast_preprocess('#define A 1\\nint a = A;')
+    #line 1 "<string>"
+    <BLANKLINE>
+    int a = 1;
+    >>> fast_preprocess('#define UINT64_C(c) c##ul\\nunsigned long a = UINT64_C(0x10) + UINT64_C(3);')
+    #line 1 "<string>"
+    <BLANKLINE>
+    unsigned long a = 0x10ul + 3ul;
+    >>> fast_preprocess('#define bool char\\n#define zig_unreachable() abort()\\nbool f() { zig_unreachable(); } // done')
+    #line 1 "<string>"
+    <BLANKLINE>
+    <BLANKLINE>
+    char f() { abort(); }  
+    >>> fast_preprocess('#define F(x) G(x)+1\\n#define G(x) F(x)*2\\nint a = F(G(3));')
+    #line 1 "<string>"
+    <BLANKLINE>
+    <BLANKLINE>
+    int a = F(G(3)+1*2)*2+1;
+    >>> fast_preprocess('#if defined(X)\\nint a;\\n#else\\nint b;\\n#endif\\n#ifndef X\\nint c;\\n#endif')
+    #line 1 "<string>"
+    <BLANKLINE>
+    <BLANKLINE>
+    <BLANKLINE>
+    int b;
+    <BLANKLINE>
+    <BLANKLINE>
+    int c;
+    <BLANKLINE>
+    >>> fast_preprocess('/* a\\n b */ int a; #pragma once')
+    #line 1 "<string>"
+    <BLANKLINE>
+     int a; #pragma once
+    >>> fast_preprocess('#if X > 1\\n#endif')
+    Traceback (most recent call last):
+    ...
+    cmin.Unsupported: #if X > 1
+    >>> fast_preprocess('#define S(x) #x')
+    Traceback (most recent call last):
+    ...
+    cmin.Unsupported: #define S(x) #x
+    """
+    cpp = ZigPreprocessor()
+    cpp.parse(s, '<string>')
+    buf = StringIO()
+    cpp.write(buf)
+    print(buf.getvalue(), end='')
+
+
+def preprocess(prolog, code, input, fast=True):
+    paths = [os.path.dirname(__file__)]
+    if fast:
+        cpp = ZigPreprocessor(paths)
+        try:
+            cpp.parse(prolog + code, input)
+        except Unsupported:
+            pass
+        else:
+            buf = StringIO()
+            cpp.write(buf)
+            return buf.getvalue()
+
+    cpp = Preprocessor()
+    for path in paths:
+        cpp.add_path(path)
     cpp.parse(prolog + code, input)
 
     buf = StringIO()
     cpp.write(buf)
     assert cpp.return_code == 0, "preprocessor error"
+    return buf.getvalue()
+
+
+C_TOKEN = re.compile(r'''
+    (?P<directive>^[ \t]*\#[^\n]*)
+  | (?P<space>[^\S\n]+|\n)
+  | (?P<wstring>(?:L|u8|u|U)"(?:\\.|[^"\\\n])*")
+  | (?P<wchar>(?:L|u8|u|U)'(?:\\.|[^'\\\n])*')
+  | (?P<id>[A-Za-z_$][\w$]*)
+  | (?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+  | (?P<string>"(?:\\.|[^"\\\n])*")
+  | (?P<char>'(?:\\.|[^'\\\n])*')
+  | (?P<op>\.\.\.|<<=|>>=|->|\+\+|--|<<|>>|&&|\|\||[-+*/%&|^!=<>]=|[-+*/%&|^~!<>=?:;,.()\[\]{}])
+  | (?P<error>.)
+''', re.M | re.X)
+C_LINE = re.compile(r'[ \t]*\#[ \t]*(?:line[ \t]+)?(\d+)(?:[ \t]+"([^"]*)")?')
+C_PRAGMA = re.compile(r'[ \t]*\#[ \t]*pragma(?:[ \t]+(.*)|$)')
+C_CHAR = re.compile(r"'(?:[^'\\\n]|\\(?:[0-7]{1,3}|x[0-9a-fA-F]+|.))'")
+
+C_STORAGE = {'auto', 'register', 'static', 'extern', 'typedef', '_Thread_local'}
+C_QUALIFIERS = {'const', 'restrict', 'volatile', '_Atomic'}
+C_FUNCSPEC = {'inline', '_Noreturn'}
+C_TYPES = {'void', '_Bool', 'char', 'short', 'int', 'long', 'float', 'double', '_Complex', 'signed', 'unsigned', '__int128'}
+C_TAGS = {'struct', 'union', 'enum'}
+C_SPECIFIERS = C_STORAGE | C_QUALIFIERS | C_FUNCSPEC | C_TYPES | C_TAGS | {'_Alignas'}
+C_KEYWORDS = C_SPECIFIERS | {
+    'break', 'case', 'continue', 'default', 'do', 'else', 'for', 'goto', 'if', 'return',
+    'sizeof', 'switch', 'while', 'offsetof', '_Static_assert', '_Alignof'}
+C_ASSIGN = {'=', '*=', '/=', '%=', '+=', '-=', '<<=', '>>=', '&=', '|=', '^='}
+C_UNARY = {'&', '*', '+', '-', '~', '!'}
+C_BINARY = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7, '<<': 8, '>>': 8,
+    '+': 9, '-': 9, '*': 10, '/': 10, '%': 10}
+
+
+def int_type(value):
+    suffix = value[-3:]
+    return 'unsigned ' * suffix.count('u') + 'long ' * suffix.count('l') + 'int'
+
+
+def modify_decl(decl, modifier):
+    tail = modifier
+    while tail.type:
+        tail = tail.type
+    if isinstance(decl, TypeDecl):
+        tail.type = decl
+        return modifier
+    decl_tail = decl
+    while not isinstance(decl_tail.type, TypeDecl):
+        decl_tail = decl_tail.type
+    tail.type = decl_tail.type
+    decl_tail.type = modifier
+    return decl
+
+
+def declname(decl):
+    while not isinstance(decl, TypeDecl):
+        decl = decl.type
+    return decl.declname
+
+
+def new_spec():
+    return dict(qual=[], storage=[], type=[], function=[], alignment=[])
+
+
+class Parser:
+    """Recursive descent parser for the C that comes out of preprocess.
+    Builds the same c_ast trees as pycparser's CParser."""
+
+    def __init__(self, coords=False, cache=None):
+        self.coords = coords
+        self.cache = None if coords else cache
+
+    def parse(self, text, filename='', debug=False):
+        self.text = text
+        self.filename = filename
+        self.lines = []
+        self.newlines = None
+        kinds, values, positions = [], [], []
+        for m in C_TOKEN.finditer(text):
+            kind = m.lastgroup
+            if kind == 'space':
+                continue
+            value = m.group()
+            if kind == 'directive':
+                line = C_LINE.match(value)
+                if line is not None:
+                    filename = line.group(2) or (self.lines[-1][2] if self.lines else filename)
+                    self.lines.append((m.end(), int(line.group(1)), filename))
+                    continue
+                pragma = C_PRAGMA.match(value)
+                if pragma is None:
+                    self.error(m.start(), 'Directives not supported yet')
+                kind, value = 'pragma', pragma.group(1) or ''
+            elif kind == 'id':
+                if value in C_KEYWORDS:
+                    kind = value
+            elif kind == 'op':
+                kind = value
+            elif kind == 'error':
+                self.error(m.start(), f'Illegal character {value!r}')
+            kinds.append(kind)
+            values.append(value)
+            positions.append(m.start())
+        kinds.append('eof')
+        values.append('')
+        positions.append(len(text))
+        self.kinds, self.values, self.positions = kinds, values, positions
+        self.i = 0
+        self.scopes = [{}]
+        self.identifier_types = {}
+
+        ext = []
+        while self.kinds[self.i] != 'eof':
+            if self.cache is None:
+                ext.extend(self.external_declaration())
+            else:
+                ext.extend(self.cached_declaration())
+        return FileAST(ext)
+
+    def declaration_end(self, i):
+        kinds = self.kinds
+        if kinds[i] == 'pragma':
+            return i + 1
+        depth, body = 0, False
+        while kinds[i] != 'eof':
+            kind = kinds[i]
+            i += 1
+            if kind in ('(', '[', '{'):
+                body = body or (kind == '{' and depth == 0 and kinds[i - 2] == ')')
+                depth += 1
+            elif kind in (')', ']', '}'):
+                depth -= 1
+                if depth == 0 and body:
+                    break
+            elif kind == ';' and depth == 0:
+                break
+        return i
+
+    def cached_declaration(self):
+        start, end = self.i, self.declaration_end(self.i)
+        scope = self.scopes[0]
+        ids = {self.values[j] for j in range(start, end) if self.kinds[j] == 'id'}
+        seen = tuple((name, scope[name]) for name in sorted(ids) if name in scope)
+        key = (self.text[self.positions[start]:self.positions[end - 1] + len(self.values[end - 1])], seen)
+        entry = self.cache.get(key)
+        if entry is not None:
+            nodes, declared = entry
+            scope.update(declared)
+            self.i = end
+            return clone(nodes)
+
+        nodes = []
+        while self.i < end:
+            nodes.extend(self.external_declaration())
+        if self.i == end:
+            seen = dict(seen)
+            declared = {name: scope[name] for name in ids if name in scope and seen.get(name) != scope[name]}
+            self.cache.put(key, (clone(nodes), declared))
+        return nodes
+
+    def coord(self, i=None):
+        if not self.coords:
+            return None
+        return self.location(self.positions[self.i if i is None else i])
+
+    def location(self, pos):
+        if self.newlines is None:
+            self.newlines = [m.start() for m in re.finditer('\n', self.text)]
+        filename, line, start = self.filename, 1, 0
+        i = bisect_right(self.lines, (pos,))
+        if i > 0:
+            start, line, filename = self.lines[i - 1]
+            line -= 1
+        k = bisect_left(self.newlines, pos)
+        line += k - bisect_left(self.newlines, start)
+        return Coord(filename, line, pos - (self.newlines[k - 1] if k else -1))
+
+    def error(self, pos, message):
+        raise ParseError(f'{self.location(pos)}: {message}')
+
+    def peek(self, k=0):
+        return self.kinds[self.i + k]
+
+    def next(self):
+        value = self.values[self.i]
+        self.i += 1
+        return value
+
+    def accept(self, kind):
+        if self.kinds[self.i] != kind:
+            return False
+        self.i += 1
+        return True
+
+    def expect(self, kind):
+        if self.kinds[self.i] != kind:
+            self.error(self.positions[self.i], f'before: {self.values[self.i]}')
+        return self.next()
+
+    def is_type(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return False
+
+    def starts_type(self, k=0):
+        kind = self.kinds[self.i + k]
+        return kind in C_SPECIFIERS or (kind == 'id' and self.is_type(self.values[self.i + k]))
+
+    def external_declaration(self):
+        kind = self.peek()
+        if kind == ';':
+            self.next()
+            return []
+        if kind == 'pragma':
+            return [self.pragma()]
+        if kind == '_Static_assert':
+            return [self.static_assert()]
+
+        spec = self.specifiers()
+        if self.peek() == ';':
+            return self.declaration(spec)
+
+        coord = self.coord()
+        decl = self.declarator('named')
+        if self.peek() == '{' or (isinstance(decl, FuncDecl) and self.starts_type()):
+            return [self.function_definition(spec, decl, coord)]
+        return self.declaration(spec, decl)
+
+    def function_definition(self, spec, decl, coord):
+        if not spec['type']:
+            spec['type'] = [IdentifierType(['int'], coord)]
+        func = decl
+        while not isinstance(func, FuncDecl):
+            func = func.type
+        param_decls = []
+        while self.peek() != '{':
+            param_decls.extend(self.declaration(self.specifiers()))
+        decl = self.build_declarations(spec, [dict(decl=decl, init=None)], True)[0]
+
+        self.scopes.append({})
+        if func.args is not None:
+            for param in func.args.params:
+                if isinstance(param, EllipsisParam):
+                    break
+                self.scopes[-1][param.name] = False
+        body = self.compound(scope=False)
+        return FuncDef(decl, param_decls or None, body, coord)
+
+    def declaration(self, spec, decl=None):
+        decls = []
+        if decl is not None or self.peek() != ';':
+            while True:
+                if decl is None:
+                    decl = self.declarator('named')
+                decls.append(dict(decl=decl, init=self.initializer() if self.accept('=') else None))
+                decl = None
+                if not self.accept(','):
+                    break
+        self.expect(';')
+
+        if decls:
+            return self.build_declarations(spec, decls, True)
+        types = spec['type']
+        if len(types) == 1 and isinstance(types[0], (Struct, Union, Enum)):
+            return [Decl(None, spec['qual'], spec['alignment'], spec['storage'], spec['function'],
+                         types[0], None, None, types[0].coord)]
+        self.error(self.positions[self.i - 1], 'Invalid declaration')
+
+    def build_declarations(self, spec, decls, typedef_namespace=False):
+        is_typedef = 'typedef' in spec['storage']
+        declarations = []
+        for d in decls:
+            decl = d['decl']
+            coord = decl.coord
+            if is_typedef:
+                declaration = Typedef(None, spec['qual'], spec['storage'], decl, coord)
+            else:
+                declaration = Decl(None, spec['qual'], spec['alignment'], spec['storage'], spec['function'],
+                                   decl, d.get('init'), d.get('bitsize'), coord)
+            if not isinstance(decl, (Struct, Union, Enum, IdentifierType)):
+                self.fix_decl_name_type(declaration, spec['type'])
+            if typedef_namespace:
+                self.scopes[-1][declaration.name] = is_typedef
+            declarations.append(fix_atomic_specifiers(declaration))
+        return declarations
+
+    def fix_decl_name_type(self, decl, types):
+        type = decl
+        while not isinstance(type, TypeDecl):
+            type = type.type
+        decl.name = type.declname
+        type.quals = decl.quals[:]
+
+        for t in types:
+            if not isinstance(t, IdentifierType):
+                if len(types) > 1:
+                    self.error(self.positions[self.i - 1], 'Invalid multiple types specified')
+                type.type = t
+                return decl
+
+        if not types:
+            if not isinstance(decl.type, FuncDecl):
+                self.error(self.positions[self.i - 1], 'Missing type in declaration')
+            type.type = self.identifier_type(['int'], decl.coord)
+        else:
+            type.type = self.identifier_type([name for t in types for name in t.names], types[0].coord)
+        return decl
+
+    def identifier_type(self, names, coord):
+        """Passes never change an IdentifierType that only has keywords, so
+        declarations spelling the type the same way share one node and two
+        such types are equal exactly when they are the same node."""
+        if self.coords or not all(name in C_TYPES for name in names):
+            return IdentifierType(names, coord)
+        key = tuple(names)
+        t = self.identifier_types.get(key)
+        if t is None:
+            t = self.identifier_types[key] = IdentifierType(names, coord)
+        return t
 
-    parser = CParser()
-    ast = parser.parse(buf.getvalue(), input)
-    StructDeclarationRewriter().visit(ast)
-    headers = SymbolRenamer().visit(ast)
-    generator = CGenerator(reduce_parentheses=True)
-    ccode = generator.visit(ast)
-    ccode = "".join(f"#include <{h}>\n" for h in headers) + ccode
+    def specifiers(self, storage=True):
+        spec = new_spec()
+        while True:
+            kind = self.peek()
+            if kind in C_STORAGE and storage:
+                spec['storage'].append(self.next())
+            elif kind == '_Atomic' and self.peek(1) == '(':
+                self.next()
+                self.next()
+                t = self.type_name()
+                self.expect(')')
+                t.quals.append('_Atomic')
+                spec['type'].append(t)
+            elif kind in C_QUALIFIERS:
+                spec['qual'].append(self.next())
+            elif kind in C_FUNCSPEC and storage:
+                spec['function'].append(self.next())
+            elif kind == '_Alignas':
+                coord = self.coord()
+                self.next()
+                self.expect('(')
+                arg = self.type_name() if self.starts_type() else self.conditional()
+                self.expect(')')
+                spec['alignment'].append(Alignas(arg, coord))
+            elif kind in C_TYPES:
+                spec['type'].append(IdentifierType([kind], self.coord()))
+                self.next()
+            elif kind in C_TAGS:
+                spec['type'].append(self.enum() if kind == 'enum' else self.struct())
+            elif kind == 'id' and not spec['type'] and self.is_type(self.values[self.i]):
+                spec['type'].append(IdentifierType([self.values[self.i]], self.coord()))
+                self.next()
+            else:
+                return spec
+
+    def struct(self):
+        klass = Struct if self.next() == 'struct' else Union
+        coord = self.coord()
+        name = self.next() if self.peek() == 'id' else None
+        if not self.accept('{'):
+            if name is None:
+                self.error(self.positions[self.i], f'before: {self.values[self.i]}')
+            return klass(name, None, coord)
+
+        decls = []
+        while not self.accept('}'):
+            if self.accept(';'):
+                continue
+            if self.peek() == 'pragma':
+                decls.append(self.pragma())
+                continue
+            spec = self.specifiers(storage=False)
+            if self.accept(';'):
+                if len(spec['type']) != 1:
+                    self.error(self.positions[self.i - 1], 'Invalid declaration')
+                decls.extend(self.build_declarations(spec, [dict(decl=spec['type'][0])]))
+                continue
+            members = []
+            while True:
+                if self.peek() == ':':
+                    decl = TypeDecl(None, None, None, None)
+                else:
+                    decl = self.declarator('named')
+                members.append(dict(decl=decl, bitsize=self.conditional() if self.accept(':') else None))
+                if not self.accept(','):
+                    break
+            self.expect(';')
+            decls.extend(self.build_declarations(spec, members))
+        return klass(name, decls, coord)
+
+    def enum(self):
+        coord = self.coord()
+        self.next()
+        name = self.next() if self.peek() == 'id' else None
+        if not self.accept('{'):
+            if name is None:
+                self.error(self.positions[self.i], f'before: {self.values[self.i]}')
+            return Enum(name, None, coord)
+
+        enumerators = []
+        while not self.accept('}'):
+            c = self.coord()
+            e = Enumerator(self.expect('id'), self.conditional() if self.accept('=') else None, c)
+            self.scopes[-1][e.name] = False
+            enumerators.append(e)
+            if not self.accept(','):
+                self.expect('}')
+                break
+        return Enum(name, EnumeratorList(enumerators, enumerators[0].coord), coord)
+
+    def pointer(self):
+        ptr = None
+        while self.peek() == '*':
+            coord = self.coord()
+            self.next()
+            quals = []
+            while self.peek() in C_QUALIFIERS:
+                quals.append(self.next())
+            # the leftmost pointer is the most nested one
+            ptr = PtrDecl(quals, ptr, coord)
+        return ptr
+
+    def declarator(self, kind):
+        """kind is 'named', 'abstract' or 'param' (either of them)"""
+        if self.peek() == '*':
+            ptr = self.pointer()
+            decl = self.direct_declarator(kind)
+            return modify_decl(decl or TypeDecl(None, None, None, None), ptr)
+        return self.direct_declarator(kind)
+
+    def direct_declarator(self, kind):
+        decl = None
+        if self.peek() == 'id' and kind != 'abstract':
+            decl = TypeDecl(self.values[self.i], None, None, None, self.coord())
+            self.next()
+        elif self.peek() == '(' and (kind == 'named' or self.peek(1) in ('*', '(', '[') or
+                                     (kind == 'param' and self.peek(1) == 'id' and not self.is_type(self.values[self.i + 1]))):
+            self.next()
+            decl = self.declarator(kind)
+            self.expect(')')
+        elif kind == 'named':
+            self.error(self.positions[self.i], f'before: {self.values[self.i]}')
+
+        while True:
+            coord = self.coord()
+            if self.accept('['):
+                quals = []
+                while self.peek() in C_QUALIFIERS or self.peek() == 'static':
+                    quals.append(self.next())
+                if self.peek() == '*' and self.peek(1) == ']':
+                    dim = ID(self.next(), self.coord(self.i - 1))
+                else:
+                    dim = None if self.peek() == ']' else self.assignment()
+                self.expect(']')
+                if decl is None:
+                    decl = ArrayDecl(TypeDecl(None, None, None, None), dim, quals, coord)
+                else:
+                    decl = modify_decl(decl, ArrayDecl(None, dim, quals, decl.coord))
+            elif self.accept('('):
+                args = self.parameters()
+                self.expect(')')
+                if decl is None:
+                    decl = FuncDecl(args, TypeDecl(None, None, None, None), coord)
+                else:
+                    decl = modify_decl(decl, FuncDecl(args, None, decl.coord))
+            else:
+                return decl
+
+    def parameters(self):
+        if self.peek() == ')':
+            return None
+        coord = self.coord()
+        if self.peek() == 'id' and not self.is_type(self.values[self.i]):
+            params = [ID(self.next(), coord)]
+            while self.accept(','):
+                params.append(ID(self.expect('id'), self.coord(self.i - 1)))
+            return ParamList(params, coord)
+
+        params = []
+        while True:
+            if self.peek() == '...':
+                params.append(EllipsisParam(self.coord()))
+                self.next()
+                break
+            params.append(self.parameter())
+            if not self.accept(','):
+                break
+        return ParamList(params, params[0].coord)
+
+    def parameter(self):
+        coord = self.coord()
+        spec = self.specifiers()
+        if not spec['type']:
+            spec['type'] = [IdentifierType(['int'], coord)]
+        decl = self.declarator('param')
+        if decl is not None and declname(decl) is not None:
+            return self.build_declarations(spec, [dict(decl=decl)])[0]
+        typename = Typename('', spec['qual'], None, decl or TypeDecl(None, None, None, None), coord)
+        return self.fix_decl_name_type(typename, spec['type'])
+
+    def type_name(self):
+        coord = self.coord()
+        spec = self.specifiers(storage=False)
+        decl = self.declarator('abstract')
+        typename = Typename('', spec['qual'][:], None, decl or TypeDecl(None, None, None, None), coord)
+        return self.fix_decl_name_type(typename, spec['type'])
+
+    def initializer(self):
+        coord = self.coord()
+        if not self.accept('{'):
+            return self.assignment()
+        exprs = []
+        while not self.accept('}'):
+            designators = []
+            while True:
+                if self.accept('.'):
+                    designators.append(ID(self.expect('id'), self.coord(self.i - 1)))
+                elif self.accept('['):
+                    designators.append(self.conditional())
+                    self.expect(']')
+                else:
+                    break
+            if designators:
+                self.expect('=')
+                exprs.append(NamedInitializer(designators, self.initializer()))
+            else:
+                exprs.append(self.initializer())
+            if not self.accept(','):
+                self.expect('}')
+                break
+        return InitList(exprs, coord)
+
+    def pragma(self):
+        coord = self.coord()
+        return Pragma(self.next(), coord)
+
+    def static_assert(self):
+        coord = self.coord()
+        self.next()
+        self.expect('(')
+        cond = self.conditional()
+        message = self.string() if self.accept(',') else None
+        self.expect(')')
+        return StaticAssert(cond, message, coord)
+
+    def compound(self, scope=True):
+        coord = self.coord()
+        self.expect('{')
+        if scope:
+            self.scopes.append({})
+        items = []
+        while not self.accept('}'):
+            if self.peek() == '_Static_assert':
+                items.append(self.static_assert())
+            elif self.starts_type():
+                items.extend(self.declaration(self.specifiers()))
+            else:
+                items.append(self.statement())
+        self.scopes.pop()
+        return Compound(items or None, coord)
+
+    def pragma_statement(self):
+        if self.peek() != 'pragma':
+            return self.statement()
+        coord = self.coord()
+        return Compound([self.pragma(), self.statement()], coord)
+
+    def statement(self):
+        kind = self.peek()
+        coord = self.coord()
+        if kind == '{':
+            return self.compound()
+        if kind == 'pragma':
+            return self.pragma()
+        if kind == '_Static_assert':
+            return self.static_assert()
+        if kind == 'id' and self.peek(1) == ':':
+            name = self.next()
+            self.next()
+            return Label(name, self.pragma_statement(), coord)
+        if kind == ';':
+            self.next()
+            return EmptyStatement(coord)
+        if kind not in C_KEYWORDS:
+            expr = self.expression()
+            self.expect(';')
+            return expr
+
+        self.next()
+        if kind == 'case':
+            expr = self.conditional()
+            self.expect(':')
+            return Case(expr, [self.pragma_statement()], coord)
+        if kind == 'default':
+            self.expect(':')
+            return Default([self.pragma_statement()], coord)
+        if kind == 'if':
+            cond = self.condition()
+            iftrue = self.pragma_statement()
+            iffalse = self.pragma_statement() if self.accept('else') else None
+            return If(cond, iftrue, iffalse, coord)
+        if kind == 'switch':
+            cond = self.condition()
+            return fix_switch_cases(Switch(cond, self.pragma_statement(), coord))
+        if kind == 'while':
+            cond = self.condition()
+            return While(cond, self.pragma_statement(), coord)
+        if kind == 'do':
+            stmt = self.pragma_statement()
+            self.expect('while')
+            cond = self.condition()
+            self.expect(';')
+            return DoWhile(cond, stmt, coord)
+        if kind == 'for':
+            self.expect('(')
+            if self.starts_type():
+                init = DeclList(self.declaration(self.specifiers()), coord)
+            else:
+                init = self.optional_expression(';')
+            cond = self.optional_expression(';')
+            step = self.optional_expression(')')
+            return For(init, cond, step, self.pragma_statement(), coord)
+        if kind == 'goto':
+            name = self.expect('id')
+            self.expect(';')
+            return Goto(name, coord)
+        if kind == 'break':
+            self.expect(';')
+            return Break(coord)
+        if kind == 'continue':
+            self.expect(';')
+            return Continue(coord)
+        if kind == 'return':
+            return Return(self.optional_expression(';'), coord)
+
+        self.i -= 1
+        expr = self.expression()
+        self.expect(';')
+        return expr
+
+    def condition(self):
+        self.expect('(')
+        expr = self.expression()
+        self.expect(')')
+        return expr
+
+    def optional_expression(self, end):
+        expr = None if self.peek() == end else self.expression()
+        self.expect(end)
+        return expr
+
+    def expression(self):
+        expr = self.assignment()
+        if self.peek() != ',':
+            return expr
+        exprs = [expr]
+        while self.accept(','):
+            exprs.append(self.assignment())
+        return ExprList(exprs, expr.coord)
+
+    def assignment(self):
+        start = self.i
+        expr = self.conditional()
+        if self.peek() in C_ASSIGN:
+            if isinstance(expr, (TernaryOp, BinaryOp, Cast)) and not self.parenthesized(start):
+                self.error(self.positions[self.i], f'before: {self.values[self.i]}')
+            op = self.next()
+            return Assignment(op, expr, self.assignment(), expr.coord)
+        return expr
+
+    def parenthesized(self, start):
+        if self.kinds[start] != '(':
+            return False
+        depth = 0
+        for i in range(start, self.i):
+            depth += {'(': 1, ')': -1}.get(self.kinds[i], 0)
+            if depth == 0:
+                return i == self.i - 1
+        return False
+
+    def conditional(self):
+        cond = self.binary(1)
+        if not self.accept('?'):
+            return cond
+        iftrue = self.expression()
+        self.expect(':')
+        return TernaryOp(cond, iftrue, self.conditional(), cond.coord)
+
+    def binary(self, precedence):
+        left = self.cast()
+        while True:
+            p = C_BINARY.get(self.peek())
+            if p is None or p < precedence:
+                return left
+            op = self.next()
+            left = BinaryOp(op, left, self.binary(p + 1), left.coord)
+
+    def cast(self):
+        if self.peek() == '(' and self.starts_type(1):
+            coord = self.coord()
+            self.next()
+            type = self.type_name()
+            self.expect(')')
+            if self.peek() == '{':
+                return self.postfix(CompoundLiteral(type, self.initializer()))
+            return Cast(type, self.cast(), coord)
+        return self.unary()
+
+    def unary(self):
+        kind = self.peek()
+        coord = self.coord()
+        if kind == '++' or kind == '--':
+            self.next()
+            expr = self.unary()
+            return UnaryOp(kind, expr, expr.coord)
+        if kind in C_UNARY:
+            self.next()
+            expr = self.cast()
+            return UnaryOp(kind, expr, expr.coord)
+        if kind == 'sizeof' or kind == '_Alignof':
+            self.next()
+            if self.peek() == '(' and self.starts_type(1):
+                self.next()
+                expr = self.type_name()
+                self.expect(')')
+            else:
+                expr = self.unary()
+            return UnaryOp(kind, expr, coord)
+        return self.postfix(self.primary())
+
+    def postfix(self, expr):
+        while True:
+            kind = self.peek()
+            if kind == '[':
+                self.next()
+                expr = ArrayRef(expr, self.expression(), expr.coord)
+                self.expect(']')
+            elif kind == '(':
+                self.next()
+                args = None
+                if self.peek() != ')':
+                    args = [self.assignment()]
+                    while self.accept(','):
+                        args.append(self.assignment())
+                    args = ExprList(args, args[0].coord)
+                self.expect(')')
+                expr = FuncCall(expr, args, expr.coord)
+            elif kind == '.' or kind == '->':
+                self.next()
+                field = ID(self.expect('id'), self.coord(self.i - 1))
+                expr = StructRef(expr, kind, field, expr.coord)
+            elif kind == '++' or kind == '--':
+                self.next()
+                expr = UnaryOp('p' + kind, expr, expr.coord)
+            else:
+                return expr
+
+    def primary(self):
+        kind = self.peek()
+        coord = self.coord()
+        if kind == 'id':
+            return ID(self.next(), coord)
+        if kind == 'number':
+            value = self.next()
+            lower = value.lower()
+            if 'x' in lower and 'p' in lower or 'x' not in lower and ('.' in lower or 'e' in lower):
+                if 'x' in lower or lower[-1] == 'f':
+                    type = 'float'
+                elif lower[-1] == 'l':
+                    type = 'long double'
+                else:
+                    type = 'double'
+            else:
+                type = int_type(lower)
+            return Constant(type, value, coord)
+        if kind == 'char':
+            value = self.next()
+            return Constant('char' if C_CHAR.fullmatch(value) else int_type(value.lower()), value, coord)
+        if kind == 'wchar':
+            return Constant('char', self.next(), coord)
+        if kind == 'string' or kind == 'wstring':
+            return self.string()
+        if kind == '(':
+            self.next()
+            expr = self.expression()
+            self.expect(')')
+            return expr
+        if kind == 'offsetof':
+            self.next()
+            self.expect('(')
+            type = self.type_name()
+            self.expect(',')
+            member = ID(self.expect('id'), self.coord(self.i - 1))
+            while True:
+                if self.accept('.'):
+                    member = StructRef(member, '.', ID(self.expect('id'), self.coord(self.i - 1)), member.coord)
+                elif self.accept('['):
+                    member = ArrayRef(member, self.expression(), member.coord)
+                    self.expect(']')
+                else:
+                    break
+            self.expect(')')
+            return FuncCall(ID('offsetof', coord), ExprList([type, member], coord), coord)
+        self.error(self.positions[self.i], f'before: {self.values[self.i]}')
+
+    def string(self):
+        kind = self.peek()
+        if kind != 'string' and kind != 'wstring':
+            self.error(self.positions[self.i], f'before: {self.values[self.i]}')
+        node = Constant('string', self.next(), self.coord(self.i - 1))
+        while self.peek() == kind:
+            if kind == 'string':
+                node.value = node.value[:-1] + self.next()[1:]
+            else:
+                node.value = node.value.rstrip()[:-1] + self.next()[2:]
+        return node
+
+
+def same_ast(s):
+    """Parses s with both Parser and CParser and checks that the trees agree.
+
+    >>> print(CGenerator().visit(same_ast('typedef int T; void f(void) { T a; { int T = 1; T = a; } }')))
+    typedef int T;
+    void f(void)
+    {
+      T a;
+      {
+        int T = 1;
+        T = a;
+      }
+    }
+    <BLANKLINE>
+    <BLANKLINE>
+    >>> print(CGenerator().visit(same_ast('int (*(*f)(int))[3]; char * const * p;')))
+    int (*(*f)(int))[3];
+    char * const *p;
+    <BLANKLINE>
+    >>> print(CGenerator().visit(same_ast('typedef int T; int g(int x) { return (T)x + (x) * sizeof(T[2]); }')))
+    typedef int T;
+    int g(int x)
+    {
+      return ((T) x) + (x * (sizeof(T [2])));
+    }
+    <BLANKLINE>
+    <BLANKLINE>
+    >>> print(CGenerator().visit(same_ast('char *s = "a" "b"; long x = 1ul + \\'a\\' + 1.5f;')))
+    char *s = "ab";
+    long x = (1ul + 'a') + 1.5f;
+    <BLANKLINE>
+    >>> Parser().parse('int x = ;', 'a.c')
+    Traceback (most recent call last):
+    ...
+    pycparser.plyparser.ParseError: a.c:1:9: before: ;
+    >>> Parser().parse('void f(int a, int b) { a ? b : a = b; }', 'a.c')
+    Traceback (most recent call last):
+    ...
+    pycparser.plyparser.ParseError: a.c:1:34: before: =
+    >>> Parser().parse('int f(void) { return ({ 1; }); }', 'a.c')
+    Traceback (most recent call last):
+    ...
+    pycparser.plyparser.ParseError: a.c:1:23: before: {
+    >>> print(CGenerator().visit(same_ast('void f(int a, int b, int *p) { (a ? p : &b)[0] = 1; (a ? a : b) = (a) = b; }')))
+    void f(int a, int b, int *p)
+    {
+      (a ? p : &b)[0] = 1;
+      (a ? a : b) = (a = b);
+    }
+    <BLANKLINE>
+    <BLANKLINE>
+    """
+    ast = Parser().parse(s)
+    expected, actual = StringIO(), StringIO()
+    CParser().parse(s).show(expected)
+    ast.show(actual)
+    assert actual.getvalue() == expected.getvalue(), actual.getvalue()
+    return ast
+
+
+class DeclarationCache:
+    """Parsed top-level declarations keyed by their text and the typedef names
+    they refer to, so that a rebuild only parses the declarations that changed.
+    Entries not used since the last sweep are dropped.
+
+    >>> cache = DeclarationCache()
+    >>> ast = parse('typedef int T; T x; int f(void) { return x; }', 'a.c', cache=cache)
+    >>> cache.sweep()
+    >>> ast = parse('typedef int T; T x; int f(void) { return x + 1; }', 'a.c', cache=cache)
+    >>> cache.hits, cache.misses
+    (2, 1)
+    >>> print(CGenerator().visit(ast))
+    typedef int T;
+    T x;
+    int f(void)
+    {
+      return x + 1;
+    }
+    <BLANKLINE>
+    <BLANKLINE>
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key) or self.used.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        self.used[key] = entry
+
+    def sweep(self):
+        self.entries, self.used = self.used, {}
+        self.hits = self.misses = 0
+
+
+def parse(text, filename, fast=True, cache=None):
+    if fast:
+        try:
+            return Parser(cache=cache).parse(text, filename)
+        except ParseError:
+            pass
+    return CParser().parse(text, filename)
+
+
+class Pass(NamedTuple):
+    name: str
+    level: int
+    make: Any
+    repeat: bool = False
+
+
+PASSES = (
+    Pass('structs', 0, lambda bits: StructDeclarationRewriter()),
+    Pass('strings', 1, lambda bits: StringPool()),
+    Pass('gotos', 1, lambda bits: GotoCleaner()),
+    Pass('rename', 0, lambda bits: SymbolRenamer()),
+    Pass('signatures', 1, lambda bits: SignatureRewriter()),
+    Pass('constants', 1, lambda bits: ConstantPropagator(bits)),
+    Pass('fold', 1, lambda bits: DuplicateFolder()),
+    Pass('order', 1, lambda bits: DeclarationOrder()),
+    Pass('names', 1, lambda bits: NameAllocator()),
+    Pass('literals', 1, lambda bits: LiteralRewriter(bits), True),
+    Pass('initializers', 1, lambda bits: InitializerRewriter()),
+    Pass('peephole', 2, lambda bits: Peephole(), True),
+)
+
+
+class PassManager:
+    """Runs the passes of an optimization level in order. Level 0 only
+    renames, level 1 adds the cheap rewrites, level 2 runs every pass once
+    and level 3 repeats the rewriting passes until they stop saving bytes.
+    Optional passes are skipped once budget seconds have passed or the
+    output is at most size bytes.
+
+    >>> optimize('int total = 10000; int main() { int count = (int)1; { if (count) { return total * 1000; } } }', 1)
+    int main()
+    {
+      int A = 1;
+      {
+        if (A)
+        {
+          return 10000 * 1000;
+        }
+      }
+    }
+    <BLANKLINE>
+         0  structs
+         0  strings
+         0  gotos
+        16  rename
+         0  signatures
+        11  constants
+         0  fold
+         0  order
+         0  names
+         6  literals
+         0  initializers
+    >>> optimize('int total = 10000; int main() { int count = (int)1; { if (count) { return total * 1000; } } }', 3, disable=['strings'])
+    int main()
+    {
+      int A = 1;
+      if (A)
+        return 10000 * 1000;
+    }
+    <BLANKLINE>
+         0  structs
+         0  gotos
+        16  rename
+         0  signatures
+        11  constants
+         0  fold
+         0  order
+         0  names
+         6  literals
+         0  initializers
+        24  peephole
+    >>> optimize('int total = 10000; int main() { int count = (int)1; { if (count) { return total * 1000; } } }', 3, size=100)
+    int main()
+    {
+      int A = (int) 1;
+      {
+        if (A)
+        {
+          return 10000 * 1000;
+        }
+      }
+    }
+    <BLANKLINE>
+         0  structs
+         0  strings
+         0  gotos
+        16  rename
+         0  signatures
+        11  constants
+    """
 
-    if output is None:
-        print(ccode)
+    def __init__(self, level=2, enable=(), disable=(), budget=None, size=None, measure=False, fused=False):
+        names = [p.name for p in PASSES]
+        for name in (*enable, *disable):
+            assert name in names, f"unknown pass {name!r}"
+        for p in PASSES:
+            assert p.level > 0 or p.name not in disable, f"pass {p.name!r} is required"
+        self.passes = [p for p in PASSES
+                       if (p.level <= level or p.name in enable) and p.name not in disable]
+        if fused:
+            self.passes = [p._replace(make=lambda bits: SymbolRenamer(StructDeclarationRewriter())) if p.name == 'rename' else p
+                           for p in self.passes if p.name != 'structs']
+        self.fixpoint = level >= 3
+        self.budget = budget
+        self.target = size
+        self.measure = measure or self.fixpoint or size is not None
+        self.headers = []
+        self.names = EMPTY
+        self.visitors = {}
+        self.stats = {}
+
+    def size(self, ast):
+        code = CGenerator(reduce_parentheses=True, names=self.names).visit(ast)
+        return len(code) + sum(len(f"#include <{h}>\n") for h in self.headers)
+
+    def done(self, start, size):
+        if self.budget is not None and time.perf_counter() - start > self.budget:
+            return True
+        return self.target is not None and size <= self.target
+
+    def apply(self, p, ast, bits, size):
+        visitor = p.make(bits)
+        start = time.perf_counter()
+        with naming(self.names):
+            result = visitor.visit(ast)
+        seconds = time.perf_counter() - start
+        if p.name == 'rename':
+            self.headers = result
+        elif p.name == 'names':
+            self.names = visitor.names
+        saved = 0
+        if self.measure:
+            new = self.size(ast)
+            saved, size = size - new, new
+        runs, total, bytes = self.stats.get(p.name, (0, 0.0, 0))
+        self.stats[p.name] = (runs + 1, total + seconds, bytes + saved)
+        self.visitors[p.name] = visitor
+        return size
+
+    def run(self, ast, bits):
+        start = time.perf_counter()
+        size = self.size(ast) if self.measure else None
+        for p in self.passes:
+            if p.level == 0 or not self.done(start, size):
+                size = self.apply(p, ast, bits, size)
+        while self.fixpoint and not self.done(start, size):
+            before = size
+            for p in self.passes:
+                if p.repeat:
+                    size = self.apply(p, ast, bits, size)
+            if size >= before:
+                break
+        return self.headers
+
+    def report(self, file=None):
+        for name, (runs, seconds, saved) in self.stats.items():
+            print(f"{saved:>6}  saved by {name} in {runs} runs, {seconds * 1000:.1f}ms", file=file)
+
+
+def optimize(s, level=2, bits=(8, 16, 32, 64, 64, 64), **options):
+    ast = same_ast(s)
+    passes = PassManager(level, **options, measure=True)
+    headers = passes.run(ast, bits)
+    print("".join(f"#include <{h}>\n" for h in headers) + CGenerator(reduce_parentheses=True, names=passes.names).visit(ast), end='')
+    for name, (runs, seconds, saved) in passes.stats.items():
+        print(f"{saved:>6}  {name}")
+
+
+def counting(cls):
+    class Counting(cls):
+        visits = 0
+
+        def visit(self, node):
+            self.visits += 1
+            return super().visit(node)
+    return Counting
+
+
+def rename_and_emit(ast, fused, wrap=lambda cls: cls):
+    """Splits struct declarations, renames and generates code, either in
+    three walks or with the struct splitting folded into renaming. Returns
+    the code and the visitors used.
+
+    >>> ast = same_ast('struct P { int x, y; } a, b; int main() { struct Q { int z; } c, d; a.x = b.y; return c.z + d.z; }')
+    >>> for fused in (False, True):
+    ...     code, visitors = rename_and_emit(clone(ast), fused, counting)
+    ...     print(len(code), [v.visits for v in visitors])
+    142 [9, 34, 35]
+    142 [34, 35]
+    """
+    visitors = []
+    if fused:
+        visitors.append(wrap(SymbolRenamer)(StructDeclarationRewriter()))
     else:
-        with open(output, "w") as f:
-            f.write(ccode)
+        visitors.append(wrap(StructDeclarationRewriter)())
+        visitors.append(wrap(SymbolRenamer)())
+    for v in visitors:
+        headers = v.visit(ast)
+    generator = wrap(CGenerator)(reduce_parentheses=True)
+    visitors.append(generator)
+    return "".join(f"#include <{h}>\n" for h in headers) + generator.visit(ast), visitors
+
+
+def fusion_benchmark(code, input, bits, repeat=5, file=None):
+    ast = parse(preprocess(''.join(define_inttypes(bits)), code, input), input)
+    for fused in (False, True):
+        visits = sum(v.visits for v in rename_and_emit(clone(ast), fused, counting)[1])
+        best = None
+        for _ in range(repeat):
+            tree = clone(ast)
+            start = time.perf_counter()
+            rename_and_emit(tree, fused)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        print(f"{'fused' if fused else 'sequence':<8}  {visits:>7} visits  {best * 1000:8.1f}ms", file=file)
+
+
+class Result(NamedTuple):
+    code: str
+    headers: list
+    stats: dict
+    hits: dict
+
+
+def minify(source, bits, filename='<string>', cache=None, **options):
+    r"""Minifies source for the widths in bits, which are those of char,
+    short, int, long, long long and pointers. options are those of
+    PassManager. Every call has its own preprocessor, parser and passes,
+    so calls may run in parallel threads as long as they do not share a
+    cache.
+
+    >>> source = 'extern int printf(const char *, ...); int square(int value) { return value * value; }'
+    >>> result = minify(source + 'int main() { printf("%d\\n", square(12)); }', (8, 16, 32, 64, 64, 64))
+    >>> print(result.code, end='')
+    #include <stdio.h>
+    int A(int A)
+    {
+      return A * A;
+    }
+    <BLANKLINE>
+    int main()
+    {
+      printf("%d\n", A(12));
+    }
+    <BLANKLINE>
+    >>> result.headers, result.stats['rename'][0]
+    (['stdio.h'], 1)
+    >>> sources = [source + f'int main() {{ printf("%d\\n", square({i})); }}' for i in range(8)]
+    >>> with ThreadPoolExecutor(4) as pool:
+    ...     codes = [r.code for r in pool.map(lambda s: minify(s, (8, 16, 32, 32, 64, 32), level=3), sources)]
+    >>> codes == [minify(s, (8, 16, 32, 32, 64, 32), level=3).code for s in sources]
+    True
+    """
+    ast = parse(preprocess(''.join(define_inttypes(bits)), source, filename), filename, cache=cache)
+    manager = PassManager(**options)
+    headers = manager.run(ast, bits)
+    code = "".join(f"#include <{h}>\n" for h in headers) + CGenerator(reduce_parentheses=True, names=manager.names).visit(ast)
+    hits = {name: v.hits for name, v in manager.visitors.items() if getattr(v, 'hits', None)}
+    return Result(code, headers, manager.stats, hits)
+
+
+def autotune_candidates(disable=()):
+    yield {'level': 2, 'disable': []}
+    yield {'level': 3, 'disable': []}
+    for p in PASSES:
+        if p.level > 0 and p.name not in disable:
+            yield {'level': 3, 'disable': [p.name]}
+
+
+def tuned(options, config):
+    return {**options, 'level': config['level'], 'disable': [*options.get('disable', ()), *config['disable']]}
+
+
+def autotune_run(ast, bits, options):
+    try:
+        manager = PassManager(**options)
+        headers = manager.run(ast, bits)
+        code = CGenerator(reduce_parentheses=True, names=manager.names).visit(ast)
+        parse(code, '<autotune>')
+    except (AssertionError, ParseError):
+        return None
+    return "".join(f"#include <{h}>\n" for h in headers) + code
+
+
+def autotune(parsed, code, input, bits, options, cases_dir=None, store=None):
+    """Returns options with the level and the further disabled passes that
+    give the smallest output for bits. Every candidate runs on its own copy
+    of the parsed tree in a process pool, and its output must parse again
+    and, given cases_dir, pass the cases. The winner is stored per input,
+    bits, options and whether cases were judged, and reused while the
+    input stays the same.
+
+    >>> with TemporaryDirectory() as store:
+    ...     source = 'extern int printf(const char *, ...); int main() { printf("%d %d", 1, 2); }'
+    ...     ast = parse(preprocess('', source, 'a.c'), 'a.c')
+    ...     options = autotune(ast, source, 'a.c', (8, 16, 32, 64, 64, 64), {'fused': True}, store=store)
+    ...     again = autotune(None, source, 'a.c', (8, 16, 32, 64, 64, 64), {'fused': True}, store=store)
+    ...     other = autotune(ast, source, 'a.c', (8, 16, 32, 64, 64, 64), {'disable': ['fold']}, store=store)
+    ...     stored = len(os.listdir(store))
+    >>> options
+    {'fused': True, 'level': 2, 'disable': []}
+    >>> again == options
+    True
+    >>> other, stored
+    ({'disable': ['fold'], 'level': 2}, 2)
+    """
+    if store is None:
+        store = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "cmin", "autotune")
+    key = json.dumps([os.path.abspath(input), bits, options, cases_dir is not None], sort_keys=True, default=list)
+    path = os.path.join(store, sha256(key.encode()).hexdigest() + ".json")
+    digest = sha256(code.encode()).hexdigest()
+    try:
+        with open(path, 'r') as f:
+            stored = json.load(f)
+        if stored["digest"] == digest:
+            return tuned(options, stored["config"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    candidates = list(autotune_candidates(options.get('disable', ())))
+    with ProcessPoolExecutor() as pool:
+        codes = list(pool.map(autotune_run, repeat(parsed), repeat(bits), [tuned(options, c) for c in candidates]))
+    ranked = sorted((len(c), i) for i, c in enumerate(codes) if c is not None)
+    assert ranked, "no candidate output parses"
+    winner = next((i for _, i in ranked
+                   if cases_dir is None or verify(cases_dir, [(f"candidate{i}", codes[i])], file=sys.stderr) == 0), None)
+    assert winner is not None, "no candidate passes the cases"
+
+    try:
+        os.makedirs(store, exist_ok=True)
+        with open(path + ".tmp", 'w') as f:
+            json.dump({"input": input, "bits": bits, "digest": digest, "config": candidates[winner], "size": len(codes[winner])}, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    return tuned(options, candidates[winner])
+
+
+def build(code, input, targets, report_top=None, verify_dir=None, cache=None, passes=None, tune=False):
+    for prolog, configs in group_targets(targets).items():
+        parsed = parse(preprocess(prolog, code, input), input, cache=cache)
+
+        for i, (bits, outputs) in enumerate(configs.items()):
+            options = passes or {}
+            if tune:
+                cases_dir = None if verify_dir is None else os.path.join(verify_dir, os.path.splitext(outputs[0] or input)[0])
+                options = autotune(parsed, code, input, bits, options, cases_dir)
+            ast = parsed if i == len(configs) - 1 else clone(parsed)
+            manager = PassManager(**options, measure=report_top is not None)
+            headers = manager.run(ast, bits)
+            generator = CGenerator(reduce_parentheses=True, names=manager.names)
+            ccode = generator.visit(ast)
+            ccode = "".join(f"#include <{h}>\n" for h in headers) + ccode
+
+            if report_top is not None:
+                visitors = manager.visitors
+                report(ast, headers, visitors['rename'], generator, report_top, sys.stderr, visitors.get('strings'),
+                       [visitors[name] for name in ('gotos', 'signatures', 'constants', 'fold', 'order', 'literals', 'initializers', 'peephole') if name in visitors])
+                manager.report(sys.stderr)
+
+            for output in outputs:
+                if output is None:
+                    print(ccode)
+                else:
+                    with open(output, "w") as f:
+                        f.write(ccode)
+
+                if verify_dir is not None:
+                    path = os.path.splitext(output or input)[0]
+                    cases_dir = os.path.join(verify_dir, path)
+                    programs = [("original", prolog + code, os.path.dirname(os.path.abspath(__file__))),
+                                ("minified", ccode)]
+                    failures = verify(cases_dir, programs, file=sys.stderr)
+                    assert failures == 0, f"{failures} cases failed"
+
+
+def watch_input(input, targets, interval, report_top=None, verify_dir=None, passes=None, tune=False):
+    cache = DeclarationCache()
+    last = None
+    while True:
+        time_i = mtime(input)
+        if time_i is not None and time_i != last:
+            last = time_i
+            start = time.perf_counter()
+            with open(input, 'r') as f:
+                code = f.read()
+            try:
+                build(code, input, targets, report_top, verify_dir, cache, passes, tune)
+            except (ParseError, AssertionError) as e:
+                print(f"{input}: {e}", file=sys.stderr)
+            else:
+                print(f"{input}: rebuilt in {time.perf_counter() - start:.3f}s, "
+                      f"{cache.misses} of {cache.hits + cache.misses} declarations parsed", file=sys.stderr)
+            cache.sweep()
+        time.sleep(interval)
+
+
+def main(bits, input, output=None, report_top=None, verify_dir=None, targets=(), watch=None,
+         level=2, enable=(), disable=(), budget=None, size=None, fused=False, benchmark=None, autotune=False):
+    targets = [(bits, output), *targets]
+    passes = dict(level=level, enable=enable, disable=disable, budget=budget, size=size, fused=fused)
+    if benchmark is not None:
+        with open(input, 'r') as f:
+            code = f.read()
+        for bits in group_targets(targets).values():
+            for b in bits:
+                fusion_benchmark(code, input, b, benchmark, sys.stderr)
+        return
+    if watch is not None:
+        return watch_input(input, targets, watch, report_top, verify_dir, passes, autotune)
+    if report_top is None and verify_dir is None:
+        time_i = mtime(input)
+        assert time_i is not None, f"{input} not found"
+        targets = [(bits, output) for bits, output in targets
+                   if output is None or (mtime(output) or 0) <= time_i]
+        if not targets:
+            return
+
+    with open(input, 'r') as f:
+        code = f.read()
+    build(code, input, targets, report_top, verify_dir, passes=passes, tune=autotune)
 
 if __name__ == '__main__':
-    import sys
-    main(*sys.argv[1:])
+    from argparse import ArgumentParser
+    argparser = ArgumentParser()
+    argparser.add_argument('bits')
+    argparser.add_argument('input')
+    argparser.add_argument('output', nargs='?')
+    argparser.add_argument('--report', dest='report_top', type=int, nargs='?', const=10, metavar='N',
+                           help='print the N largest declarations and why they are kept')
+    argparser.add_argument('--verify', dest='verify_dir', metavar='TESTS',
+                           help='compile and judge the original and minified code against TESTS/<output>/<case>/{in,out}')
+    argparser.add_argument('--target', dest='targets', nargs=2, action='append', default=[], metavar=('BITS', 'OUTPUT'),
+                           help='also minify for BITS into OUTPUT, sharing the parse when possible')
+    argparser.add_argument('--watch', type=float, nargs='?', const=0.2, metavar='SECONDS',
+                           help='poll INPUT every SECONDS and rebuild on change, re-parsing only changed declarations')
+    argparser.add_argument('-O', dest='level', type=int, choices=range(4), default=2,
+                           help='0 only renames, 1 runs the cheap passes, 2 runs every pass once, 3 repeats passes until they stop saving bytes')
+    argparser.add_argument('--enable', action='append', default=[], choices=[p.name for p in PASSES], metavar='PASS',
+                           help='run PASS even if the level does not include it')
+    argparser.add_argument('--disable', action='append', default=[], choices=[p.name for p in PASSES], metavar='PASS',
+                           help='do not run PASS')
+    argparser.add_argument('--budget', type=float, metavar='SECONDS',
+                           help='skip remaining optional passes after SECONDS')
+    argparser.add_argument('--size', type=int, metavar='BYTES',
+                           help='skip remaining optional passes once the output is at most BYTES')
+    argparser.add_argument('--fused', action='store_true',
+                           help='split struct declarations while renaming instead of in a walk of its own')
+    argparser.add_argument('--benchmark', type=int, nargs='?', const=5, metavar='N',
+                           help='instead of minifying, print the visits and best of N times of renaming and emitting, with and without --fused')
+    argparser.add_argument('--autotune', action='store_true',
+                           help='try pass configurations in parallel and keep the one with the smallest output that parses again and passes --verify; the choice is stored per input')
+    main(**vars(argparser.parse_args()))